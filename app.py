@@ -1,29 +1,1488 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from openai import OpenAI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+import asyncio
+import bisect
+import gzip
+import hashlib
+import hmac
+import httpx
+import json
+import logging
 import os
-from typing import Dict, List
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zlib
+from enum import Enum
+from types import MappingProxyType
+from typing import Dict, List, Optional
+
+try:
+    import h2  # noqa: F401  (dépendance optionnelle : httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import brotli  # dépendance optionnelle : variantes .br du frontend
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
 
 load_dotenv()
-client = OpenAI()
+
+logger = logging.getLogger("spacescenes")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s — %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.getenv("SPACESCENES_LOG_LEVEL", "INFO"))
+
+
+# === MÉTRIQUES (format Prometheus) ===
+# Compteurs et histogrammes en mémoire, exposés par GET /metrics.
+# Une observation = une recherche dichotomique + quelques additions : assez léger pour la prod.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000)
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}  # label_values -> [compte par bucket..., +Inf, somme]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """Valeur lue au moment du scrape (jauges d'état, compteurs tenus par d'autres objets)"""
+
+    def __init__(self, name: str, help: str, kind: str, read):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.read()}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, read):
+        self._metrics.append(CallbackMetric(name, help, "gauge", read))
+
+    def counter_from(self, name: str, help: str, read):
+        self._metrics.append(CallbackMetric(name, help, "counter", read))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+CHAT_REQUESTS = metrics.counter(
+    "spacescenes_chat_requests_total", "Requêtes /chat par endpoint et statut", ("endpoint", "status"))
+CHAT_LATENCY = metrics.histogram(
+    "spacescenes_chat_request_seconds", "Durée totale d'une requête /chat par scène", ("endpoint", "scene"))
+CHAT_SPANS = metrics.histogram(
+    "spacescenes_chat_span_seconds", "Durée des étapes de /chat", ("span",))
+UPSTREAM_TTFT = metrics.histogram(
+    "spacescenes_upstream_ttft_seconds", "Délai avant le premier token (= durée totale hors streaming)", ("endpoint",))
+UPSTREAM_QUEUE_WAIT = metrics.histogram(
+    "spacescenes_upstream_queue_seconds", "Attente dans la file du scheduler amont")
+ADMISSION_REJECTED = metrics.counter(
+    "spacescenes_admission_rejected_total", "Tours refusés par le contrôle d'admission, par motif", ("reason",))
+SCENE_VALIDATIONS = metrics.counter(
+    "spacescenes_scene_validations_total", "Scènes validées par phase et résultat (ok / invalid)", ("phase", "result"))
+SCENE_VALIDATION_FAILURES = metrics.counter(
+    "spacescenes_scene_validation_failures_total", "Défauts de format par phase et motif", ("phase", "reason"))
+SCENE_REPAIRS = metrics.counter(
+    "spacescenes_scene_repairs_total", "Réparations par phase et issue (trimmed / repaired / filtered / failed)",
+    ("phase", "outcome"))
+PROMPT_TOKENS = metrics.counter(
+    "spacescenes_prompt_tokens_total", "Tokens de prompt facturés (cached = servis par le cache de préfixe)", ("cached",))
+COMPLETION_TOKENS = metrics.counter(
+    "spacescenes_completion_tokens_total", "Tokens générés")
+ROUTE_REQUESTS = metrics.counter(
+    "spacescenes_route_requests_total", "Appels par route (phase, modèle) et résultat", ("phase", "model", "outcome"))
+ROUTE_LATENCY = metrics.histogram(
+    "spacescenes_route_seconds", "Durée des appels réussis par route", ("phase", "model"))
+ROUTE_COST = metrics.counter(
+    "spacescenes_route_cost_usd_total", "Coût estimé des appels par route, en dollars", ("phase", "model"))
+PROMPT_TOKENS_BY_SCENE = metrics.histogram(
+    "spacescenes_prompt_tokens", "Tokens de prompt par requête et par scène", ("scene",), TOKEN_BUCKETS)
+
+
+@contextmanager
+def span(name: str):
+    """Mesure la durée d'une étape du traitement de /chat"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        CHAT_SPANS.observe(time.perf_counter() - started, name)
+
+
+class WorkerState:
+    """État du démarrage du worker, exposé par /readyz"""
+
+    def __init__(self):
+        self.ready = False
+        self.detail = "Démarrage en cours"
+        self.started = time.perf_counter()
+        self.startup_seconds: Optional[float] = None
+
+
+worker_state = WorkerState()
+
+
+async def start_worker():
+    """Crée le client amont et chauffe son pool (réessaie jusqu'à y parvenir), puis pré-génère les ouvertures"""
+    delay = 0.5
+    while True:
+        try:
+            get_client()
+            if UPSTREAM_WARMUP:
+                await asyncio.wait_for(warm_up_upstream(), UPSTREAM_CONNECT_TIMEOUT + UPSTREAM_ATTEMPT_TIMEOUT)
+            break
+        except Exception as exc:
+            worker_state.detail = f"API amont indisponible : {exc}"
+            logger.warning("⏳ Démarrage : %s — nouvel essai dans %.1f s", worker_state.detail, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    worker_state.startup_seconds = time.perf_counter() - worker_state.started
+    worker_state.ready = True
+    worker_state.detail = "Prêt"
+    logger.info(
+        "🚀 SpaceScenes API lancée avec ChatGPT — ready to fly among the stars 🌌 (prête en %.2f s)",
+        worker_state.startup_seconds,
+    )
+    if not model_router.has_fallbacks:
+        logger.info("🔀 Aucun modèle de repli configuré : routes fixes, santé des modèles non suivie")
+    if OPENING_CACHE_PREWARM:
+        await prewarm_opening_cache()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ouvre le store, le journal et le frontend, puis démarre en tâche de fond (client amont,
+    pool, ouvertures) ; arrêt : jobs batch et spéculations annulés, fermeture du pool et du journal.
+    Tout est remis à zéro : un lifespan suivant (second TestClient) repart de ressources neuves"""
+    worker_state.started = time.perf_counter()
+    get_session_store()
+    get_journal()
+    await asyncio.to_thread(get_static_assets)
+    startup = asyncio.create_task(start_worker())
+    yield
+    worker_state.ready = False
+    worker_state.detail = "Arrêt en cours"
+    startup.cancel()
+    running = [job.task for job in batch_jobs.values() if job.status == "running"]
+    for task in running:
+        task.cancel()
+    await asyncio.gather(startup, *running, return_exceptions=True)
+    await speculator.close()
+    await close_client()
+    close_journal()
 
 
 app = FastAPI(
     title="SpaceScenes API",
     version="1.0.0",
     description="Intergalactical Story Generator",
+    lifespan=lifespan,
 )
 
 # === GESTION DES SESSIONS ===
-# Dictionnaire pour stocker les sessions utilisateur (en production, utiliser Redis ou une BDD)
-sessions: Dict[str, dict] = {}
+# Backend de stockage : "memory" (LRU + TTL, un seul worker) ou "sqlite" (fichier partagé entre workers).
+# Avec "sqlite", les workers sont sans état : chaque requête relit la session, et l'écriture
+# n'aboutit que si personne ne l'a modifiée entre-temps (verrouillage optimiste par version).
+SESSION_STORE_BACKEND = os.getenv("SPACESCENES_SESSION_STORE", "memory")
+SESSION_TTL = float(os.getenv("SPACESCENES_SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.getenv("SPACESCENES_MAX_SESSIONS", "10000"))
+SESSION_DB_PATH = os.getenv("SPACESCENES_SESSION_DB", "sessions.db")
+# Attente maximale d'un verrou SQLite tenu par un autre worker : les appels au store bloquent
+# la boucle d'événements, on préfère un 503 rapide à une boucle figée
+SESSION_DB_BUSY_TIMEOUT = float(os.getenv("SPACESCENES_SESSION_DB_BUSY_TIMEOUT", "0.1"))
+# Plafond par session (une partie complète fait 11 tours) : avec MAX_SESSIONS,
+# borne la mémoire occupée par les sessions
+SESSION_MAX_TURNS = int(os.getenv("SPACESCENES_SESSION_MAX_TURNS", "30"))
+MAX_MESSAGE_CHARS = int(os.getenv("SPACESCENES_MAX_MESSAGE_CHARS", "2000"))
+
+
+# Les scènes terminées sont gardées compressées : elles ne sont décompressées
+# que pour construire le contexte envoyé au modèle
+TURN_COMPRESS_MIN_CHARS = int(os.getenv("SPACESCENES_TURN_COMPRESS_MIN_CHARS", "256"))
+
+
+class Role(str, Enum):
+    USER = "user"
+    ASSISTANT = "assistant"
+
+
+class Turn:
+    """Un message de l'historique : texte court internalisé, ou scène compressée (zlib)"""
+
+    __slots__ = ("role", "data")
+
+    def __init__(self, role: Role, content: str):
+        self.role = role
+        if len(content) >= TURN_COMPRESS_MIN_CHARS:
+            self.data = zlib.compress(content.encode("utf-8"))
+        else:
+            # Les messages de choix ("Je choisis l'option (1)") sont partagés entre toutes les sessions
+            self.data = sys.intern(content)
+
+    @classmethod
+    def loaded(cls, role: Role, content: str) -> "Turn":
+        """Message relu d'un store partagé : la copie ne vit que le temps d'une requête, on ne la compresse pas"""
+        turn = cls.__new__(cls)
+        turn.role = role
+        turn.data = sys.intern(content) if len(content) < TURN_COMPRESS_MIN_CHARS else content
+        return turn
+
+    @property
+    def content(self) -> str:
+        if isinstance(self.data, bytes):
+            return zlib.decompress(self.data).decode("utf-8")
+        return self.data
+
+    def as_message(self) -> dict:
+        return {"role": self.role.value, "content": self.content}
+
+
+@dataclass(slots=True)
+class Session:
+    """État d'une aventure"""
+
+    scene_count: int = 0
+    has_chosen: bool = False
+    character_chosen: bool = False
+    history: List[Turn] = field(default_factory=list)  # Historique des messages pour maintenir le contexte
+    summary: str = ""
+    summarized_upto: int = 0  # nombre de messages de l'historique déjà repliés dans le résumé
+    version: int = 0  # version lue dans le store (0 = jamais enregistrée), hors to_dict()
+
+    def add_turn(self, role: Role, content: str):
+        self.history.append(Turn(role, content))
+
+    def to_dict(self) -> dict:
+        return {
+            "sceneCount": self.scene_count,
+            "hasChosen": self.has_chosen,
+            "character_chosen": self.character_chosen,
+            "history": [turn.as_message() for turn in self.history],
+            "summary": self.summary,
+            "summarized_upto": self.summarized_upto,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        return cls(
+            scene_count=data["sceneCount"],
+            has_chosen=data["hasChosen"],
+            character_chosen=data["character_chosen"],
+            history=[Turn.loaded(Role(msg["role"]), msg["content"]) for msg in data["history"]],
+            summary=data.get("summary", ""),
+            summarized_upto=data.get("summarized_upto", 0),
+        )
+
+
+class SessionConflict(Exception):
+    """La session a été modifiée (ou supprimée) par une autre requête depuis sa lecture"""
+
+
+class SessionStore:
+    """Interface commune des stockages de sessions.
+
+    Les sessions renvoyées par get() peuvent être des copies : toute modification
+    doit être enregistrée avec save(). save() lève SessionConflict si la version
+    stockée n'est plus celle lue par get(), et incrémente session.version sinon.
+    save_summary() n'écrit que le résumé, sans changer la version : un tour joué
+    pendant le calcul du résumé reste valide.
+    """
+
+    def get(self, session_id: str) -> Optional[Session]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: Session) -> None:
+        raise NotImplementedError
+
+    def history_length(self, session_id: str) -> Optional[int]:
+        """Nombre de messages de la session (None si absente), sans la charger"""
+        raise NotImplementedError
+
+    def save_summary(self, session_id: str, summary: str, start: int, upto: int, version: int) -> bool:
+        """Remplace le résumé des messages [0, start) par celui des messages [0, upto).
+
+        N'écrit rien si la session a été réinitialisée (version inférieure à celle lue,
+        historique plus court que `upto`) ou si son résumé ne s'arrête plus à `start`
+        (déjà remplacé par un autre worker).
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions en mémoire, évincées au-delà de max_sessions (LRU) ou après ttl secondes d'inactivité"""
+
+    def __init__(self, max_sessions: int, ttl: float):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (expiration, session, version)
+        self.evicted = 0
+        self.expired = 0
+
+    def _purge_expired(self, now: float):
+        # L'ordre LRU est aussi l'ordre d'expiration : les plus anciennes sont en tête
+        while self._sessions:
+            session_id, (expires_at, _, _) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def get(self, session_id: str) -> Optional[Session]:
+        now = time.monotonic()
+        self._purge_expired(now)
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        self._sessions[session_id] = (now + self.ttl, entry[1], entry[2])
+        self._sessions.move_to_end(session_id)
+        return entry[1]
+
+    def save(self, session_id: str, session: Session) -> None:
+        now = time.monotonic()
+        self._purge_expired(now)
+        entry = self._sessions.get(session_id)
+        if (entry[2] if entry else 0) != session.version:
+            raise SessionConflict(session_id)
+        session.version += 1
+        self._sessions[session_id] = (now + self.ttl, session, session.version)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def history_length(self, session_id: str) -> Optional[int]:
+        entry = self._sessions.get(session_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return len(entry[1].history)
+
+    def save_summary(self, session_id: str, summary: str, start: int, upto: int, version: int) -> bool:
+        entry = self._sessions.get(session_id)
+        if (entry is None or entry[2] < version or entry[1].summarized_upto != start
+                or len(entry[1].history) < upto):
+            return False
+        entry[1].summary = summary
+        entry[1].summarized_upto = upto
+        return True
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        self._purge_expired(time.monotonic())
+        return len(self._sessions)
+
+
+class SqliteSessionStore(SessionStore):
+    """Sessions dans un fichier SQLite (mode WAL) partagé par plusieurs workers uvicorn.
+
+    Sémantique proche de Redis (GET / SET avec expiration / DEL) : un serveur Redis
+    peut le remplacer sans changer le reste de l'application. Le résumé a ses propres
+    colonnes, écrites sans toucher à la version (l'équivalent d'un second champ de hash).
+    """
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str, ttl: float, busy_timeout: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        # Délai large pour la création du schéma (workers lancés ensemble), court ensuite
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "version" not in columns:
+            # Fichier créé avant le verrouillage optimiste
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "summary" not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN summarized_upto INTEGER NOT NULL DEFAULT 0")
+        # Comptage des sessions actives et purge des expirées sans parcourir toute la table
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+        self._conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+
+    @contextmanager
+    def _locked(self):
+        """Accès exclusif à la connexion ; base verrouillée trop longtemps → 503"""
+        with self._lock:
+            try:
+                yield
+            except sqlite3.OperationalError as exc:
+                logger.warning("⏳ Store de sessions indisponible : %s", exc)
+                raise HTTPException(
+                    status_code=503, detail="Sessions momentanément indisponibles, réessayez.",
+                    headers={"Retry-After": "1"},
+                )
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._locked():
+            row = self._conn.execute(
+                "SELECT data, version, summary, summarized_upto FROM sessions"
+                " WHERE session_id = ? AND expires_at > ?",
+                (session_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        session = Session.from_dict(json.loads(row[0]))
+        session.version = row[1]
+        if row[3] > session.summarized_upto:
+            # Résumé écrit par save_summary() après la dernière sauvegarde complète
+            session.summary, session.summarized_upto = row[2], row[3]
+        return session
+
+    def save(self, session_id: str, session: Session) -> None:
+        data = json.dumps(session.to_dict(), ensure_ascii=False)
+        now = time.time()
+        with self._locked():
+            if session.version == 0:
+                # Nouvelle session : ne remplace qu'une ligne expirée
+                cursor = self._conn.execute(
+                    "INSERT INTO sessions (session_id, data, expires_at, version, summary, summarized_upto)"
+                    " VALUES (?, ?, ?, 1, ?, ?)"
+                    " ON CONFLICT(session_id) DO UPDATE SET"
+                    " data = excluded.data, expires_at = excluded.expires_at, version = 1,"
+                    " summary = excluded.summary, summarized_upto = excluded.summarized_upto"
+                    " WHERE sessions.expires_at <= ?",
+                    (session_id, data, now + self.ttl, session.summary, session.summarized_upto, now),
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET data = ?, expires_at = ?, version = version + 1"
+                    " WHERE session_id = ? AND version = ?",
+                    (data, now + self.ttl, session_id, session.version),
+                )
+            if cursor.rowcount == 0:
+                raise SessionConflict(session_id)
+            session.version += 1
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def history_length(self, session_id: str) -> Optional[int]:
+        with self._locked():
+            row = self._conn.execute(
+                "SELECT json_array_length(data, '$.history') FROM sessions WHERE session_id = ? AND expires_at > ?",
+                (session_id, time.time()),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def save_summary(self, session_id: str, summary: str, start: int, upto: int, version: int) -> bool:
+        with self._locked():
+            cursor = self._conn.execute(
+                "UPDATE sessions SET summary = ?, summarized_upto = ?"
+                " WHERE session_id = ? AND version >= ? AND expires_at > ?"
+                " AND MAX(summarized_upto, json_extract(data, '$.summarized_upto')) = ?"
+                " AND json_array_length(data, '$.history') >= ?",
+                (summary, upto, session_id, version, time.time(), start, upto),
+            )
+        return cursor.rowcount == 1
+
+    def delete(self, session_id: str) -> None:
+        with self._locked():
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def __len__(self) -> int:
+        with self._locked():
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)
+            ).fetchone()
+        return row[0]
+
+
+def create_session_store() -> SessionStore:
+    """Instancie le backend de sessions choisi par SPACESCENES_SESSION_STORE"""
+    if SESSION_STORE_BACKEND == "sqlite":
+        return SqliteSessionStore(SESSION_DB_PATH, SESSION_TTL, SESSION_DB_BUSY_TIMEOUT)
+    if SESSION_STORE_BACKEND == "memory":
+        return MemorySessionStore(MAX_SESSIONS, SESSION_TTL)
+    raise ValueError(f"Backend de sessions inconnu : {SESSION_STORE_BACKEND}")
+
+
+# Ouvert par le lifespan du worker, pas à l'import ; créé au premier besoin sinon
+session_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    """Store de sessions partagé, ouvert au démarrage du worker (ou au premier besoin)"""
+    global session_store
+    if session_store is None:
+        session_store = create_session_store()
+    return session_store
+
+
+# === JOURNAL DES AVENTURES (reprise après redémarrage) ===
+# Chaque tour est ajouté à un journal append-only (SQLite en mode WAL). Les écritures passent
+# par une file et un thread dédié qui les regroupe : une seule synchronisation disque par lot,
+# rien sur le chemin critique de la requête. Au redémarrage, une session absente du store
+# est reconstruite à partir du journal lors de son premier accès.
+JOURNAL_ENABLED = os.getenv("SPACESCENES_JOURNAL", "1") == "1"
+JOURNAL_PATH = os.getenv("SPACESCENES_JOURNAL_PATH", "journal.db")
+JOURNAL_BATCH_SIZE = int(os.getenv("SPACESCENES_JOURNAL_BATCH_SIZE", "256"))
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("SPACESCENES_JOURNAL_FLUSH_INTERVAL", "0.2"))
+JOURNAL_RETENTION = float(os.getenv("SPACESCENES_JOURNAL_RETENTION", str(7 * 24 * 3600)))
+JOURNAL_RESET_TIMEOUT = float(os.getenv("SPACESCENES_JOURNAL_RESET_TIMEOUT", "5"))
+
+
+class AdventureJournal:
+    """Journal append-only des tours de chaque session"""
+
+    PURGE_EVERY = 1000  # lots écrits entre deux purges des entrées expirées
+
+    def __init__(self, path: str, batch_size: int, flush_interval: float, retention: float):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._queue: "queue.Queue" = queue.Queue()
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"  # 'turn' ou 'reset'
+            " prompt TEXT,"
+            " response TEXT,"
+            " state TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        self._reader.execute("CREATE INDEX IF NOT EXISTS journal_session ON journal (session_id, id)")
+        self.written = 0
+        self.restored = 0
+        # Resets encore en file : tant que le marqueur n'est pas écrit, load() ne doit pas
+        # ressusciter les tours précédents
+        self._pending_resets: Dict[str, int] = {}
+        self._thread = threading.Thread(target=self._run, name="adventure-journal", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def append_turn(self, session_id: str, session: Session, prompt: str, response: str):
+        state = json.dumps({
+            "sceneCount": session.scene_count,
+            "hasChosen": session.has_chosen,
+            "character_chosen": session.character_chosen,
+        })
+        self._queue.put(((session_id, "turn", prompt, response, state, time.time()), None))
+
+    def append_reset(self, session_id: str) -> threading.Event:
+        """Met le marqueur de reset en file ; l'événement renvoyé est levé une fois le marqueur écrit"""
+        written = threading.Event()
+        with self._read_lock:
+            self._pending_resets[session_id] = self._pending_resets.get(session_id, 0) + 1
+        self._queue.put(((session_id, "reset", None, None, None, time.time()), written))
+        return written
+
+    def _reset_written(self, session_id: str, written: threading.Event):
+        with self._read_lock:
+            remaining = self._pending_resets.pop(session_id) - 1
+            if remaining:
+                self._pending_resets[session_id] = remaining
+        written.set()
+
+    def _run(self):
+        conn = self._connect()
+        batches = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            # Regroupe ce qui arrive pendant flush_interval (ou jusqu'à batch_size)
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "INSERT INTO journal (session_id, kind, prompt, response, state, created_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        [row for row, _ in batch],
+                    )
+                self.written += len(batch)
+                batches += 1
+                if batches % self.PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM journal WHERE created_at < ?", (time.time() - self.retention,))
+            except sqlite3.Error:
+                logger.exception("❌ Écriture du journal impossible (%d entrées perdues)", len(batch))
+            for row, written in batch:
+                if written is not None:
+                    self._reset_written(row[0], written)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                break
+        conn.close()
+
+    def load(self, session_id: str) -> Optional[Session]:
+        """Reconstruit une session à partir de ses tours depuis le dernier reset"""
+        with self._read_lock:
+            if session_id in self._pending_resets:
+                return None
+            rows = self._reader.execute(
+                "SELECT prompt, response, state FROM journal"
+                " WHERE session_id = ? AND kind = 'turn' AND id > ("
+                "  SELECT COALESCE(MAX(id), 0) FROM journal WHERE session_id = ? AND kind = 'reset')"
+                " ORDER BY id",
+                (session_id, session_id),
+            ).fetchall()
+        if not rows:
+            return None
+
+        state = json.loads(rows[-1][2])
+        session = Session(
+            scene_count=state["sceneCount"],
+            has_chosen=state["hasChosen"],
+            character_chosen=state["character_chosen"],
+        )
+        for prompt, response, _ in rows:
+            session.add_turn(Role.USER, prompt)
+            session.add_turn(Role.ASSISTANT, response)
+        self.restored += 1
+        return session
+
+    def flush(self):
+        """Attend que toutes les entrées en file soient écrites"""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+# Ouvert par le lifespan et refermé à l'arrêt (un lifespan suivant en rouvre un neuf)
+journal: Optional[AdventureJournal] = None
+
+
+def get_journal() -> Optional[AdventureJournal]:
+    """Journal du worker, ouvert au premier besoin ; None s'il est désactivé"""
+    global journal
+    if journal is None and JOURNAL_ENABLED:
+        journal = AdventureJournal(JOURNAL_PATH, JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_INTERVAL, JOURNAL_RETENTION)
+    return journal
+
+
+def close_journal():
+    """Écrit ce qui reste en file et arrête le thread du journal"""
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
 
 class ChatMessage(BaseModel):
     message: str
     session_id: str = "default"
+    request_id: Optional[str] = None  # clé d'idempotence (alternative à l'en-tête Idempotency-Key)
+
+# === SCHEDULER DES APPELS À L'API ===
+# Nombre maximum d'appels simultanés vers l'API, taille de la file d'attente
+# et délai maximum passé dans la file avant de répondre 503
+MAX_INFLIGHT_UPSTREAM = int(os.getenv("SPACESCENES_MAX_INFLIGHT", "64"))
+MAX_QUEUED_UPSTREAM = int(os.getenv("SPACESCENES_MAX_QUEUED", "256"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("SPACESCENES_QUEUE_TIMEOUT", "30"))
+
+
+class UpstreamScheduler:
+    """Limite les appels simultanés vers l'API et met les suivants en file d'attente"""
+
+    def __init__(self, max_inflight: int, max_queued: int, queue_timeout: float):
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Réserve une place pour un appel amont (429 si la file est pleine, 503 si l'attente expire)"""
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Trop d'aventures en cours, réessayez dans un instant.",
+                headers={"Retry-After": "1"},
+            )
+
+        self.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Le vaisseau IA est saturé, réessayez plus tard.",
+                headers={"Retry-After": str(int(self.queue_timeout))},
+            )
+        finally:
+            self.queued -= 1
+            UPSTREAM_QUEUE_WAIT.observe(time.perf_counter() - started)
+
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._semaphore.release()
+
+
+scheduler = UpstreamScheduler(MAX_INFLIGHT_UPSTREAM, MAX_QUEUED_UPSTREAM, UPSTREAM_QUEUE_TIMEOUT)
+
+
+# === SÉRIALISATION DES TOURS PAR SESSION ===
+# Un seul tour à la fois par session : un double clic ou un client qui réessaie ne doit
+# ni payer deux complétions ni sauter une scène. Les requêtes identiques en vol
+# (même session, même message, même scène) partagent le résultat de la première ;
+# avec une clé d'idempotence (en-tête Idempotency-Key ou champ request_id),
+# le résultat est aussi rejoué pendant IDEMPOTENCY_TTL secondes après la fin du tour.
+IDEMPOTENCY_TTL = float(os.getenv("SPACESCENES_IDEMPOTENCY_TTL", "300"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("SPACESCENES_IDEMPOTENCY_MAX_KEYS", "10000"))
+
+
+class SessionGate:
+    """Verrou par session et fusion des requêtes en double"""
+
+    def __init__(self, ttl: float, max_keys: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._locks: Dict[str, list] = {}
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._completed: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.waits = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    @staticmethod
+    def key(session_id: str, prompt: str, idempotency_key: Optional[str]) -> tuple:
+        """Clé d'idempotence du client si fournie, sinon (session, message).
+
+        Sans clé du client, la fusion ne dure que le temps du tour en cours : le même message
+        renvoyé plus tard joue la scène suivante, la scène n'a donc pas à figurer dans la clé
+        (et le store n'est pas relu).
+        """
+        if idempotency_key:
+            return (session_id, "key", idempotency_key)
+        return (session_id, normalize_message(prompt))
+
+    @asynccontextmanager
+    async def lock(self, session_id: str):
+        """Attend son tour pour la session ; le verrou disparaît avec son dernier utilisateur"""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        if entry[0].locked():
+            self.waits += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+    def claim(self, key: tuple) -> Optional[asyncio.Future]:
+        """None si l'appelant doit jouer le tour, sinon le futur portant le résultat partagé"""
+        done = self._completed.get(key)
+        if done is not None:
+            expires_at, result = done
+            if expires_at > time.monotonic():
+                self.replayed += 1
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(result)
+                return future
+            del self._completed[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+
+        future = asyncio.get_running_loop().create_future()
+        # Évite l'avertissement « exception never retrieved » quand personne n'attendait
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        return None
+
+    def resolve(self, key: tuple, result: Optional[dict] = None, error: Optional[BaseException] = None):
+        """Publie le résultat (ou l'erreur) du tour aux requêtes en attente ; sans effet si déjà publié"""
+        future = self._inflight.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+            if key[1] == "key":
+                self._completed[key] = (time.monotonic() + self.ttl, result)
+                while len(self._completed) > self.max_keys:
+                    self._completed.popitem(last=False)
+            return
+        if not isinstance(error, HTTPException):
+            # Premier client parti ou erreur inattendue : les autres peuvent réessayer
+            error = HTTPException(status_code=503, detail="Tour interrompu, réessayez.")
+        future.set_exception(error)
+
+    async def run(self, key: tuple, session_id: str, play):
+        """Joue le tour une seule fois pour toutes les requêtes de même clé, sous le verrou de la session"""
+        shared = self.claim(key)
+        if shared is not None:
+            return await asyncio.shield(shared)
+        try:
+            async with self.lock(session_id):
+                result = await play()
+        except BaseException as exc:
+            self.resolve(key, error=exc)
+            raise
+        self.resolve(key, result)
+        return result
+
+
+session_gate = SessionGate(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS)
+
+
+# === CONTRÔLE D'ADMISSION ===
+# Filtre appliqué avant tout appel payant : un seau à jetons par IP et un par session,
+# un plafond de tours simultanés et un plafond de sessions actives. Au-delà de
+# ADMISSION_SHED_RATIO du plafond, seules les aventures déjà commencées passent :
+# les nouvelles parties sont refusées en premier pour protéger le p99 des joueurs en cours.
+# Un débit à 0 désactive le seau correspondant.
+RATE_LIMIT_IP_RATE = float(os.getenv("SPACESCENES_RATE_LIMIT_IP_RATE", "1"))  # requêtes par seconde
+RATE_LIMIT_IP_BURST = float(os.getenv("SPACESCENES_RATE_LIMIT_IP_BURST", "20"))
+RATE_LIMIT_SESSION_RATE = float(os.getenv("SPACESCENES_RATE_LIMIT_SESSION_RATE", "0.5"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("SPACESCENES_RATE_LIMIT_SESSION_BURST", "5"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("SPACESCENES_RATE_LIMIT_MAX_KEYS", "100000"))
+ADMISSION_MAX_ACTIVE = int(os.getenv("SPACESCENES_ADMISSION_MAX_ACTIVE", "256"))
+ADMISSION_SHED_RATIO = float(os.getenv("SPACESCENES_ADMISSION_SHED_RATIO", "0.75"))
+# Plafond de sessions actives pour les nouvelles parties (0 = aucun). En mémoire, il est
+# désactivé par défaut : le store évince déjà les sessions les moins récentes au-delà de
+# MAX_SESSIONS, alors qu'un refus bloquerait les nouveaux joueurs jusqu'à l'expiration (TTL)
+# des parties abandonnées après un afflux. SQLite n'a pas d'éviction : le plafond s'applique.
+MAX_ACTIVE_SESSIONS = int(os.getenv(
+    "SPACESCENES_MAX_ACTIVE_SESSIONS", str(MAX_SESSIONS if SESSION_STORE_BACKEND == "sqlite" else 0)
+))
+# Le nombre de sessions actives (COUNT sur SQLite) est recompté au plus une fois par intervalle
+SESSION_COUNT_INTERVAL = float(os.getenv("SPACESCENES_SESSION_COUNT_INTERVAL", "1"))
+# Derrière un reverse proxy, l'IP du client est lue dans X-Forwarded-For
+TRUST_PROXY = os.getenv("SPACESCENES_TRUST_PROXY", "0") == "1"
+
+
+class TokenBuckets:
+    """Seaux à jetons par clé (IP ou session), gardés en LRU borné"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # clé -> [jetons, dernière mise à jour]
+
+    def take(self, key: str) -> float:
+        """Consomme un jeton : 0 si accordé, sinon l'attente en secondes avant le prochain"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = [tokens, now]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """Décide si un tour peut être joué maintenant (429 si trop rapide, 503 si surcharge)"""
+
+    def __init__(
+        self,
+        ip_buckets: TokenBuckets,
+        session_buckets: TokenBuckets,
+        max_active: int,
+        shed_ratio: float,
+        max_sessions: int,
+    ):
+        self.ip_buckets = ip_buckets
+        self.session_buckets = session_buckets
+        self.max_active = max_active
+        self.shed_threshold = max_active * shed_ratio
+        self.max_sessions = max_sessions
+        self.active = 0
+        self._session_count = 0
+        self._counted_at = float("-inf")
+
+    @staticmethod
+    def client_ip(request: Request) -> str:
+        if TRUST_PROXY:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "inconnu"
+
+    @staticmethod
+    def _reject(reason: str, status_code: int, detail: str, retry_after: float):
+        ADMISSION_REJECTED.inc(reason)
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+
+    def _active_sessions(self, store: SessionStore) -> int:
+        """Nombre approximatif de sessions actives, recompté au plus toutes les SESSION_COUNT_INTERVAL s"""
+        now = time.monotonic()
+        if now - self._counted_at >= SESSION_COUNT_INTERVAL:
+            self._session_count = len(store)
+            self._counted_at = now
+        return self._session_count
+
+    @asynccontextmanager
+    async def admit(self, request: Request, session_id: str):
+        """Réserve une place pour le tour, rendue à la sortie"""
+        wait = self.ip_buckets.take(self.client_ip(request))
+        if wait:
+            self._reject("ip_rate", 429, "Trop de requêtes, ralentissez un peu.", wait)
+        wait = self.session_buckets.take(session_id)
+        if wait:
+            self._reject("session_rate", 429, "Trop de requêtes pour cette aventure.", wait)
+
+        if self.active >= self.max_active:
+            self._reject("overload", 503, "Le vaisseau IA est saturé, réessayez plus tard.", 1)
+        # La session n'est chargée qu'une fois, sous le verrou : ici, seule sa longueur compte
+        store = get_session_store()
+        history = store.history_length(session_id)
+        if not history:
+            # Nouvelle partie : refusée dès que la charge approche du plafond
+            if self.active >= self.shed_threshold:
+                self._reject("shed", 503, "Le vaisseau IA est plein, revenez dans un instant.", 5)
+            if history is None and self.max_sessions and self._active_sessions(store) >= self.max_sessions:
+                self._reject("sessions", 503, "Trop d'aventures en cours, revenez dans un instant.", 30)
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+
+
+admission = AdmissionController(
+    TokenBuckets(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST, RATE_LIMIT_MAX_KEYS),
+    TokenBuckets(RATE_LIMIT_SESSION_RATE, RATE_LIMIT_SESSION_BURST, RATE_LIMIT_MAX_KEYS),
+    ADMISSION_MAX_ACTIVE,
+    ADMISSION_SHED_RATIO,
+    MAX_ACTIVE_SESSIONS,
+)
+
+
+# === COUCHE AMONT (pool HTTP, retries, hedging) ===
+# Pool de connexions keep-alive vers l'API (HTTP/2 si le paquet h2 est installé)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("SPACESCENES_UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("SPACESCENES_UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("SPACESCENES_UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("SPACESCENES_UPSTREAM_HTTP2", "1") == "1" and HTTP2_AVAILABLE
+# Délais : connexion, chaque tentative (une longue scène prend ~30 s), et l'ensemble des tentatives
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("SPACESCENES_UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("SPACESCENES_UPSTREAM_ATTEMPT_TIMEOUT", "60"))
+UPSTREAM_DEADLINE = float(os.getenv("SPACESCENES_UPSTREAM_DEADLINE", "120"))
+# Retries sur 429 / 5xx / erreurs réseau, avec backoff exponentiel et jitter
+UPSTREAM_MAX_RETRIES = int(os.getenv("SPACESCENES_UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("SPACESCENES_UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("SPACESCENES_UPSTREAM_BACKOFF_MAX", "8"))
+# Hedging : seconde tentative si la première dépasse le p95 des latences observées
+UPSTREAM_HEDGE = os.getenv("SPACESCENES_UPSTREAM_HEDGE", "0") == "1"
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("SPACESCENES_UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError, asyncio.TimeoutError)
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Client HTTP partagé par tous les appels amont"""
+    return httpx.AsyncClient(
+        http2=UPSTREAM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(UPSTREAM_ATTEMPT_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+    )
+
+
+# Le client est créé au démarrage du worker (lifespan), pas à l'import : importer app.py
+# ne demande ni clé d'API ni réseau. Le pool est chauffé par UPSTREAM_WARMUP_CONNECTIONS
+# appels GET /models (gratuits) avant que /readyz ne réponde 200.
+UPSTREAM_WARMUP = os.getenv("SPACESCENES_UPSTREAM_WARMUP", "1") == "1"
+UPSTREAM_WARMUP_CONNECTIONS = int(os.getenv("SPACESCENES_UPSTREAM_WARMUP_CONNECTIONS", "2"))
+
+client: Optional[AsyncOpenAI] = None
+
+
+def get_client() -> AsyncOpenAI:
+    """Client amont partagé, créé au premier besoin"""
+    global client
+    if client is None:
+        # OPENAI_BASE_URL permet de viser un serveur compatible local (voir benchmarks/mock_openai.py)
+        # Les retries du SDK sont désactivés : c'est la classe Upstream qui les gère
+        client = AsyncOpenAI(http_client=build_http_client(), max_retries=0, timeout=UPSTREAM_ATTEMPT_TIMEOUT)
+    return client
+
+
+async def close_client():
+    """Ferme le pool de connexions ; le prochain get_client() en crée un neuf"""
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+
+async def warm_up_upstream():
+    """Ouvre les premières connexions du pool (TCP + TLS) avant le premier joueur"""
+    api = get_client()
+    await asyncio.gather(*(api.models.list() for _ in range(UPSTREAM_WARMUP_CONNECTIONS)))
+
+
+def upstream_http_error(exc: Exception) -> HTTPException:
+    """Traduit une erreur amont définitive en erreur HTTP pour le client"""
+    if isinstance(exc, RateLimitError):
+        return HTTPException(
+            status_code=503,
+            detail="Le vaisseau IA est saturé, réessayez plus tard.",
+            headers={"Retry-After": "5"},
+        )
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return HTTPException(status_code=504, detail="Le vaisseau IA met trop de temps à répondre.")
+    return HTTPException(status_code=502, detail=f"Erreur du vaisseau IA : {exc}")
+
+
+class Upstream:
+    """Appels à l'API avec délais par tentative et global, retries avec backoff et hedging optionnel"""
+
+    def __init__(
+        self,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        attempt_timeout: float,
+        deadline: float,
+        hedge: bool,
+        hedge_min_samples: int,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies: deque = deque(maxlen=500)
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def backoff_delay(self, attempt: int, exc: Exception) -> float:
+        """Backoff exponentiel avec jitter complet ; respecte Retry-After s'il est fourni"""
+        if isinstance(exc, APIStatusError):
+            retry_after = exc.response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _with_retries(self, call):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            try:
+                return await call(min(self.attempt_timeout, remaining))
+            except RETRYABLE_ERRORS as exc:
+                delay = self.backoff_delay(attempt, exc)
+                if attempt >= self.max_retries or loop.time() + delay >= deadline:
+                    self.failures += 1
+                    raise upstream_http_error(exc) from exc
+                logger.warning("🔁 Tentative %d échouée (%s), nouvel essai dans %.2f s", attempt + 1, exc, delay)
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+            except APIStatusError as exc:
+                self.failures += 1
+                raise upstream_http_error(exc) from exc
+
+    async def _attempt(self, kwargs: dict, timeout: float):
+        self.attempts += 1
+        started = time.perf_counter()
+        response = await asyncio.wait_for(get_client().chat.completions.create(**kwargs), timeout)
+        self.latencies.append(time.perf_counter() - started)
+        return response
+
+    async def _hedged_attempt(self, kwargs: dict, timeout: float):
+        threshold = self.p95() if self.hedge else None
+        if threshold is None or threshold >= timeout:
+            return await self._attempt(kwargs, timeout)
+
+        first = asyncio.create_task(self._attempt(kwargs, timeout))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done:
+                # La première tentative dépasse le p95 : on en lance une seconde, la plus rapide gagne
+                self.hedges += 1
+                tasks.add(asyncio.create_task(self._attempt(kwargs, timeout - threshold)))
+            error = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, **kwargs):
+        """Complétion non streamée"""
+        return await self._with_retries(lambda timeout: self._hedged_attempt(kwargs, timeout))
+
+    async def open_stream(self, **kwargs):
+        """Ouvre un flux de complétion (retries tant qu'aucun token n'a été reçu, pas de hedging)"""
+        return await self._with_retries(
+            lambda timeout: asyncio.wait_for(get_client().chat.completions.create(stream=True, **kwargs), timeout)
+        )
+
+
+upstream = Upstream(
+    UPSTREAM_MAX_RETRIES,
+    UPSTREAM_BACKOFF_BASE,
+    UPSTREAM_BACKOFF_MAX,
+    UPSTREAM_ATTEMPT_TIMEOUT,
+    UPSTREAM_DEADLINE,
+    UPSTREAM_HEDGE,
+    UPSTREAM_HEDGE_MIN_SAMPLES,
+)
+
+
+# === ROUTAGE DES MODÈLES PAR PHASE ===
+# Chaque phase de l'aventure (voir output_phase) a sa route : modèle, max_tokens, température.
+# Par défaut, max_tokens et température ne sont pas envoyés (valeurs par défaut de l'API) :
+# une scène coupée perdrait ses choix et partirait en réparation.
+# SPACESCENES_MODEL_ROUTES (JSON) surcharge la table par défaut, phase par phase, par ex. :
+#   {"finale": {"model": "gpt-4o", "max_tokens": 2000}, "intro": {"temperature": 0.7}}
+# Si la latence p95 ou le taux d'erreur d'une route dépasse son seuil, la phase passe
+# sur son modèle de repli pendant ROUTE_COOLDOWN secondes, puis le modèle principal est retenté.
+# Aucun repli par défaut : sans SPACESCENES_FALLBACK_MODEL (ou champ "fallback" d'une route)
+# distinct du modèle principal, la santé des routes n'est pas suivie et rien ne bascule.
+DEFAULT_MODEL = os.getenv("SPACESCENES_MODEL", "gpt-4o-mini")
+FALLBACK_MODEL = os.getenv("SPACESCENES_FALLBACK_MODEL") or None
+DEFAULT_MODEL_ROUTES = {
+    "intro": {},
+    "middle": {},
+    "climax": {},
+    "finale": {"max_p95": 45.0},
+}
+ROUTE_MAX_P95 = float(os.getenv("SPACESCENES_ROUTE_MAX_P95", "20"))
+ROUTE_MAX_ERROR_RATE = float(os.getenv("SPACESCENES_ROUTE_MAX_ERROR_RATE", "0.25"))
+ROUTE_MIN_SAMPLES = int(os.getenv("SPACESCENES_ROUTE_MIN_SAMPLES", "20"))
+ROUTE_WINDOW = int(os.getenv("SPACESCENES_ROUTE_WINDOW", "100"))
+ROUTE_COOLDOWN = float(os.getenv("SPACESCENES_ROUTE_COOLDOWN", "60"))
+
+# Prix en dollars par million de tokens : (prompt, prompt servi par le cache, complétion)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    **json.loads(os.getenv("SPACESCENES_MODEL_PRICES", "{}")),
+}
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    phase: str
+    model: str
+    max_tokens: Optional[int]
+    temperature: Optional[float]
+    fallback: Optional[str]
+    max_p95: float
+
+    @property
+    def params(self) -> dict:
+        """Paramètres de l'appel à l'API (max_tokens et température seulement s'ils sont fixés)"""
+        params = {"model": self.model}
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
+
+def load_model_routes() -> Dict[str, ModelRoute]:
+    """Table par défaut + surcharges de SPACESCENES_MODEL_ROUTES"""
+    overrides = json.loads(os.getenv("SPACESCENES_MODEL_ROUTES", "{}"))
+    routes = {}
+    for phase, defaults in DEFAULT_MODEL_ROUTES.items():
+        config = {
+            "model": DEFAULT_MODEL,
+            "max_tokens": None,
+            "temperature": None,
+            "fallback": FALLBACK_MODEL,
+            "max_p95": ROUTE_MAX_P95,
+        }
+        config.update(defaults)
+        config.update(overrides.get(phase, {}))
+        routes[phase] = ModelRoute(phase=phase, **config)
+    return routes
+
+
+def completion_cost(model: str, usage) -> float:
+    """Coût d'un appel en dollars (0 si le modèle n'a pas de prix connu)"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None or usage is None:
+        return 0.0
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    prompt_price, cached_price, completion_price = prices
+    return (
+        (prompt_tokens - cached_tokens) * prompt_price
+        + cached_tokens * cached_price
+        + completion_tokens * completion_price
+    ) / 1_000_000
+
+
+class RouteHealth:
+    """Latences et erreurs récentes du modèle principal d'une route"""
+
+    __slots__ = ("latencies", "errors", "degraded_until")
+
+    def __init__(self, window: int):
+        self.latencies: deque = deque(maxlen=window)
+        self.errors: deque = deque(maxlen=window)
+        self.degraded_until = 0.0
+
+
+class ModelRouter:
+    """Choisit la route de chaque phase et bascule sur le repli quand le modèle principal se dégrade"""
+
+    def __init__(self, routes: Dict[str, ModelRoute], max_error_rate: float, min_samples: int, window: int, cooldown: float):
+        self.routes = routes
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._fallbacks = {
+            phase: replace(route, model=route.fallback, fallback=None)
+            for phase, route in routes.items()
+            if route.fallback and route.fallback != route.model
+        }
+        self._health = {phase: RouteHealth(window) for phase in routes}
+        self.fallbacks = 0
+        self.degradations = 0
+
+    @property
+    def has_fallbacks(self) -> bool:
+        return bool(self._fallbacks)
+
+    def select(self, phase: str) -> ModelRoute:
+        route = self.routes[phase]
+        health = self._health[phase]
+        if health.degraded_until:
+            if time.monotonic() < health.degraded_until:
+                self.fallbacks += 1
+                return self._fallbacks[phase]
+            # Fin de la pénalité : on retente le modèle principal
+            health.degraded_until = 0.0
+        return route
+
+    def is_degraded(self, phase: str) -> bool:
+        return time.monotonic() < self._health[phase].degraded_until
+
+    def record(self, route: ModelRoute, elapsed: float, usage=None, error: bool = False):
+        """Enregistre un appel : métriques par route et santé du modèle principal"""
+        ROUTE_REQUESTS.inc(route.phase, route.model, "error" if error else "ok")
+        if not error:
+            ROUTE_LATENCY.observe(elapsed, route.phase, route.model)
+            ROUTE_COST.inc(route.phase, route.model, amount=completion_cost(route.model, usage))
+
+        if route is not self.routes[route.phase] or route.phase not in self._fallbacks:
+            return
+        health = self._health[route.phase]
+        health.errors.append(error)
+        if not error:
+            health.latencies.append(elapsed)
+        reason = self._unhealthy_reason(route, health)
+        if reason:
+            health.degraded_until = time.monotonic() + self.cooldown
+            health.latencies.clear()
+            health.errors.clear()
+            self.degradations += 1
+            logger.warning(
+                "🔀 Route %s dégradée (%s) : repli %s → %s pendant %.0f s",
+                route.phase, reason, route.model, route.fallback, self.cooldown,
+            )
+
+    def _unhealthy_reason(self, route: ModelRoute, health: RouteHealth) -> Optional[str]:
+        if len(health.errors) < self.min_samples:
+            return None
+        error_rate = sum(health.errors) / len(health.errors)
+        if error_rate > self.max_error_rate:
+            return f"erreurs {error_rate:.0%}"
+        if len(health.latencies) >= self.min_samples:
+            ordered = sorted(health.latencies)
+            p95 = ordered[int(len(ordered) * 0.95) - 1]
+            if p95 > route.max_p95:
+                return f"p95 {p95:.1f} s"
+        return None
+
+
+model_router = ModelRouter(load_model_routes(), ROUTE_MAX_ERROR_RATE, ROUTE_MIN_SAMPLES, ROUTE_WINDOW, ROUTE_COOLDOWN)
+
+
+async def create_completion(route: Optional[ModelRoute] = None, **kwargs):
+    """Appelle l'API de complétion sans bloquer la boucle, dans la limite du scheduler ;
+    avec une route, le modèle et ses paramètres viennent de la table de routage"""
+    async with scheduler.slot():
+        if route is None:
+            return await upstream.complete(**kwargs)
+        started = time.perf_counter()
+        try:
+            response = await upstream.complete(**route.params, **kwargs)
+        except HTTPException:
+            model_router.record(route, time.perf_counter() - started, error=True)
+            raise
+        model_router.record(route, time.perf_counter() - started, response.usage)
+        return response
 
 # === CONFIGURATION CORS (pour futur lien avec interface web ou Figma) ===
 app.add_middleware(
@@ -34,6 +1493,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# === COMPRESSION DES RÉPONSES ===
+# Réponses JSON de /chat, /resume, /metrics… compressées en gzip au-delà de GZIP_MIN_SIZE octets.
+# Les flux SSE ne sont jamais compressés (Starlette les exclut) et le frontend l'est déjà.
+GZIP_MIN_SIZE = int(os.getenv("SPACESCENES_GZIP_MIN_SIZE", "500"))
+GZIP_LEVEL = int(os.getenv("SPACESCENES_GZIP_LEVEL", "6"))
+
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+
 # === DÉFINITION DE L'IA ===
 AI_NAME = "Storystellar"
 AI_PERSONALITY = """
@@ -130,407 +1597,1527 @@ Ne commence jamais l'histoire tant que l'utilisateur n'a pas répondu à cette q
 """
 
 
-def get_or_create_session(session_id: str) -> dict:
+async def restore_session(session_id: str) -> Optional[Session]:
+    """Récupère une session depuis le store ou, après un redémarrage, depuis le journal"""
+    store = get_session_store()
+    session = store.get(session_id)
+    adventure_journal = get_journal()
+    if session is None and adventure_journal:
+        session = await asyncio.to_thread(adventure_journal.load, session_id)
+        if session is not None:
+            try:
+                store.save(session_id, session)
+            except SessionConflict:
+                # Reprise au même moment par un autre worker : on reprend la sienne
+                session = store.get(session_id) or session
+    return session
+
+
+async def get_or_create_session(session_id: str) -> Session:
     """Récupère ou crée une session utilisateur"""
-    if session_id not in sessions:
-        sessions[session_id] = {
-            "sceneCount": 0,
-            "hasChosen": False,
-            "history": [],  # Historique des messages pour maintenir le contexte
-            "character_chosen": False
-        }
-    return sessions[session_id]
+    session = await restore_session(session_id)
+    if session is None:
+        session = Session()
+        store = get_session_store()
+        try:
+            store.save(session_id, session)
+        except SessionConflict:
+            # Créée au même moment par un autre worker : on reprend la sienne
+            session = store.get(session_id) or session
+    return session
 
 
-def update_session_after_choice(session_id: str):
+def check_turn_allowed(session: Session):
+    """Refuse un tour de plus quand la session a atteint SESSION_MAX_TURNS"""
+    if len(session.history) >= 2 * SESSION_MAX_TURNS:
+        raise HTTPException(
+            status_code=409, detail="Cette aventure est terminée, démarrez-en une nouvelle.",
+        )
+
+
+def update_session_after_choice(session: Session):
     """Met à jour la session après qu'un choix a été fait"""
-    session = sessions[session_id]
-    session["hasChosen"] = True
-    session["sceneCount"] += 1
+    session.has_chosen = True
+    session.scene_count += 1
 
 
-def build_context_messages(session: dict, user_message: str) -> List[dict]:
-    """Construit les messages avec le contexte de la session"""
-    messages = [{"role": "system", "content": AI_PERSONALITY}]
-    
-    # Ajoute le contexte de la scène actuelle
-    scene_context = f"\n\n📍 CONTEXTE ACTUEL :\n"
-    scene_context += f"- Scène numéro : {session['sceneCount']}/10\n"
-    scene_context += f"- L'utilisateur a fait son choix : {'Oui' if session['hasChosen'] else 'Non'}\n"
-    scene_context += f"- Personnage choisi : {'Oui' if session['character_chosen'] else 'Non (demande d abord)'}\n"
-    
-    if session['sceneCount'] == 0 and not session['character_chosen']:
-        scene_context += "\n⚠️ Tu dois d'abord demander le choix du personnage avant de commencer l'histoire."
-    elif session['sceneCount'] == 9:
-        scene_context += "\n⚠️ ATTENTION : La PROCHAINE scène (scène 10) sera la FINALE. Prépare un climax."
-        scene_context += "\n✅ Pour cette scène 9, propose encore 3 choix numérotés (1), (2), (3)."
-    elif session['sceneCount'] == 10:
-        scene_context += "\n" + "🔴"*30
-        scene_context += "\n🔴🔴🔴 SCÈNE 10/10 - FINALE ABSOLUE 🔴🔴🔴"
-        scene_context += "\n" + "🔴"*30
-        scene_context += "\n\n❌ INTERDICTIONS ABSOLUES - JAMAIS DE CHOIX :"
-        scene_context += "\n   ❌ N'ÉCRIS PAS (1)"
-        scene_context += "\n   ❌ N'ÉCRIS PAS (2)"
-        scene_context += "\n   ❌ N'ÉCRIS PAS (3)"
-        scene_context += "\n   ❌ NE PROPOSE AUCUN CHOIX, AUCUNE OPTION"
-        scene_context += "\n   ❌ NE POSE AUCUNE QUESTION À L'UTILISATEUR"
-        scene_context += "\n   ❌ NE DIS PAS 'Que voulez-vous faire ?'"
-        scene_context += "\n   ❌ NE DIS PAS 'Quel est votre choix ?'"
-        scene_context += "\n   ❌ NE DIS PAS 'Choisissez'"
-        scene_context += "\n   ❌ NE DIS PAS 'vous avez trois choix'"
-        scene_context += "\n   ❌ NE DIS PAS 'vous avez plusieurs options'"
-        scene_context += "\n   ❌ NE DIS PAS 'choisissez parmi'"
-        scene_context += "\n   ❌ NE SUGGÈRES AUCUN CHOIX À L'UTILISATEUR"
-        scene_context += "\n"
-        scene_context += "\n✅ CE QUE TU DOIS FAIRE - OBLIGATOIRE :"
-        scene_context += "\n   ✅ RACONTE UNIQUEMENT la conclusion finale de l'histoire"
-        scene_context += "\n   ✅ RACONTE UNIQUEMENT CE QUI SE PASSE, PAS CE QUE L'UTILISATEUR DOIT FAIRE"
-        scene_context += "\n   ✅ TERMINE l'aventure de manière définitive"
-        scene_context += "\n   ✅ LAISSE l'utilisateur dans une situation finale, SANS SUGGÉRER d'action"
-        scene_context += "\n   ✅ ÉCRIS 'FIN' ou 'L'histoire se termine ici' à la fin"
-        scene_context += "\n   ✅ ARRÊTE-TOI APRÈS la conclusion. POINT FINAL."
-        scene_context += "\n"
-        scene_context += "\n🔴 RAPPEL CRITIQUE : C'est un RÉCIT FINAL PUR."
-        scene_context += "\n   Tu racontes ce qui se passe, l'épilogue"
-        scene_context += "\n   TU NE demandes RIEN à l'utilisateur"
-        scene_context += "\n   TU NE suggères AUCUNE action à l'utilisateur"
-        scene_context += "\n   TU NE proposes AUCUNE décision à prendre"
-        scene_context += "\n   C'est la fin du récit, point final"
-        scene_context += "\n"
-        scene_context += "\n⚠️ C'EST LA DERNIÈRE SCÈNE. L'HISTOIRE EST FINIE. "
-        scene_context += "AUCUNE interaction n'est possible après. CONCLUSION DÉFINITIVE."
-        scene_context += "\n" + "🔴"*30
-    elif session['hasChosen']:
-        scene_context += f"\n✅ L'utilisateur a fait son choix. Continue l'histoire de manière cohérente et propose 3 nouveaux choix (1), (2), (3)."
-    
-    # Ajoute l'historique des interactions
-    for msg in session['history']:
-        messages.append(msg)
-    
-    # Ajoute le message système avec le contexte
-    messages.append({"role": "system", "content": scene_context})
-    messages.append({"role": "user", "content": user_message})
-    
-    return messages
+# === COMPACTION DU CONTEXTE ===
+# "full" renvoie tout l'historique à chaque appel ; "compact" garde les derniers tours
+# mot pour mot et remplace les scènes plus anciennes par un résumé mis à jour après chaque scène
+CONTEXT_MODE = os.getenv("SPACESCENES_CONTEXT_MODE", "full")
+CONTEXT_KEEP_TURNS = int(os.getenv("SPACESCENES_CONTEXT_KEEP_TURNS", "2"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("SPACESCENES_CONTEXT_TOKEN_BUDGET", "6000"))
+SUMMARY_MODEL = os.getenv("SPACESCENES_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = int(os.getenv("SPACESCENES_SUMMARY_MAX_TOKENS", "300"))
 
+SUMMARY_INSTRUCTIONS = """
+Tu tiens le résumé d'une aventure interactive de science-fiction.
+Mets à jour le résumé existant avec les nouvelles scènes en ne gardant que les faits clés :
+personnage incarné, lieux, alliés, ennemis, objets importants, choix du joueur et leurs conséquences.
+Style télégraphique, 150 mots maximum, aucun choix numéroté, aucune phrase d'introduction.
+"""
 
-# === ROUTE DE TEST (home) ===
 
-@app.get("/", response_class=HTMLResponse)
-def home():
-    return """
-    <html>
-      <head>
-        <title>SpaceScenes - Intergalactic Adventures</title>
-        <style>
-          body {
-            background-color: black;
-            color: #FFE81F;
-            font-family: 'Courier New', monospace;
-            text-align: center;
-            padding-top: 80px;
-          }
-          #story {
-            width: 80%;
-            margin: 40px auto;
-            text-align: left;
-            white-space: pre-wrap;
-            font-size: 20px;
-            line-height: 1.6;
-            min-height: 200px;
-          }
-          #debug {
-            background-color: #1a1a1a;
-            border: 2px solid #FFE81F;
-            padding: 15px;
-            margin: 20px auto;
-            width: 80%;
-            text-align: left;
-            font-size: 14px;
-            color: #00ff00;
-          }
-          button {
-            background-color: #FFE81F;
-            color: black;
-            border: none;
-            padding: 15px 30px;
-            font-size: 18px;
-            font-weight: bold;
-            cursor: pointer;
-            border-radius: 10px;
-            margin: 5px;
-          }
-          button:hover {
-            background-color: #fff176;
-          }
-          button:disabled {
-            background-color: #666;
-            cursor: not-allowed;
-          }
-        </style>
-      </head>
-      <body>
-        <h1>🚀 Bienvenue dans SpaceScenes</h1>
-        <p>Je suis Storystellar, narrateur de l'espace.<br>
-        Choisissez votre destin parmi les étoiles…</p>
-
-        <button onclick="startAdventure()">Démarrer l'aventure</button>
-        <button onclick="resetAdventure()" style="background-color: #ff5252;">Recommencer</button>
-
-         <!-- 🐛 Zone de debug -->
-         <div id="debug">
-           <strong>📊 DEBUG - État de la session :</strong><br>
-           Scène : <span id="debug-scene">0</span> / 10<br>
-           Choix effectué : <span id="debug-chosen">Non</span><br>
-           Personnage choisi : <span id="debug-character">Non</span>
-         </div>
-
-         <div id="story"></div>
-         <div id="choices" style="margin-top: 20px; display: none;"></div>
-
-         <script>
-          let isWriting = false;
-          const SESSION_ID = 'user_' + Math.random().toString(36).substr(2, 9);
-
-          function updateDebug(data) {
-            if (data.debug) {
-              document.getElementById('debug-scene').textContent = data.debug.sceneCount;
-              document.getElementById('debug-chosen').textContent = data.debug.hasChosen ? 'Oui' : 'Non';
-              document.getElementById('debug-character').textContent = data.debug.character_chosen ? 'Oui' : 'Non';
-            }
-          }
-
-          async function startAdventure() {
-            if (isWriting) return;
-        
-            const storyDiv = document.getElementById('story');
-            storyDiv.innerHTML = "Chargement de la première scène...<br>";
-            
-            isWriting = true;
-        
-            const res = await fetch('/chat', {
-              method: 'POST',
-              headers: {'Content-Type': 'application/json'},
-              body: JSON.stringify({ 
-                message: 'Salut, démarre une aventure.',
-                session_id: SESSION_ID
-              })
-            });
-            
-            const data = await res.json();
-            updateDebug(data);
-            
-            const text = data.response || "Erreur de communication avec le vaisseau IA.";
-        
-            storyDiv.innerHTML = "";
-            await typeWriter(text, storyDiv);
-        
-            isWriting = false;
-          }
-
-          async function resetAdventure() {
-            const res = await fetch('/reset', {
-              method: 'POST',
-              headers: {'Content-Type': 'application/json'},
-              body: JSON.stringify({ session_id: SESSION_ID })
-            });
-            
-            document.getElementById('story').innerHTML = "";
-            document.getElementById('choices').style.display = "none";
-            document.getElementById('debug-scene').textContent = "0";
-            document.getElementById('debug-chosen').textContent = "Non";
-            document.getElementById('debug-character').textContent = "Non";
-            
-            alert("🔄 Aventure réinitialisée ! Cliquez sur 'Démarrer l'aventure' pour recommencer.");
-          }
-        
-          async function typeWriter(text, element) {
-            element.innerHTML = "";
-            for (let i = 0; i < text.length; i++) {
-              element.innerHTML += text.charAt(i);
-              await new Promise(r => setTimeout(r, 20));
-            }
-          
-            const matches = text.match(/\(\d+\)/g);
-            const choicesDiv = document.getElementById('choices');
-            
-            // Vérifier le numéro de scène actuel
-            const currentScene = parseInt(document.getElementById('debug-scene').textContent);
-            
-            // Afficher les boutons pour les scènes 0 à 9 (la scène 9 permet de choisir, puis génère la scène 10)
-            // La scène 10 est la finale, sans boutons
-            if (matches && currentScene < 10) {
-              choicesDiv.innerHTML = "";
-              choicesDiv.style.display = "block";
-            
-              matches.forEach(match => {
-                const number = match.match(/\d+/)[0];
-                const btn = document.createElement("button");
-                btn.className = "choice-btn";
-                btn.textContent = match;
-                btn.onclick = () => sendChoice(number);
-                choicesDiv.appendChild(btn);
-              });
-            } else if (currentScene >= 10) {
-              // Message de fin si on est à la scène finale (10)
-              choicesDiv.innerHTML = "<p style='color: #FFE81F; font-size: 18px;'>🏁 FIN DE L'AVENTURE 🏁</p>";
-              choicesDiv.style.display = "block";
-            }
-          }
-          
-          async function sendChoice(number) {
-            if (isWriting) return;
-            
-            const storyDiv = document.getElementById('story');
-            const choicesDiv = document.getElementById('choices');
-            
-            // Désactive les boutons
-            const buttons = choicesDiv.querySelectorAll('button');
-            buttons.forEach(btn => btn.disabled = true);
-            
-            choicesDiv.style.display = "none";
-            
-            storyDiv.innerHTML += `<br><em>→ Choix (${number}) sélectionné</em><br><br>`;
-          
-            isWriting = true;
-            
-            const res = await fetch('/chat', {
-              method: 'POST',
-              headers: {'Content-Type': 'application/json'},
-              body: JSON.stringify({ 
-                message: `Je choisis l'option (${number})`,
-                session_id: SESSION_ID
-              })
-            });
-          
-            const data = await res.json();
-            updateDebug(data);
-            
-            await typeWriter(data.response, storyDiv);
-            
-            isWriting = false;
-          }
-
-        </script>
-      </body>
-    </html>
-    """
+def estimate_tokens(messages: List[dict]) -> int:
+    """Estimation rapide du nombre de tokens (≈ 4 caractères par token + surcoût par message)"""
+    return sum(len(msg["content"]) // 4 + 4 for msg in messages)
 
 
-# === ROUTE /CHAT — pour parler à l'IA ===
-@app.post("/chat")
-async def chat(user_message: ChatMessage):
-    prompt = user_message.message
+def select_history(session: Session, fixed_tokens: int) -> List[dict]:
+    """Renvoie la partie de l'historique à envoyer au modèle selon le mode de contexte"""
+    history = session.history
+    if CONTEXT_MODE != "compact":
+        return [turn.as_message() for turn in history]
+
+    messages = []
+    summary = session.summary
+    if summary:
+        messages.append({"role": "system", "content": f"📜 RÉSUMÉ DE L'HISTOIRE JUSQU'ICI :\n{summary}"})
+
+    recent = [turn.as_message() for turn in history[session.summarized_upto:]]
+    # Budget de tokens : on abandonne les tours les plus anciens (par paire user/assistant),
+    # en gardant toujours au moins le dernier tour
+    budget = CONTEXT_TOKEN_BUDGET - fixed_tokens - estimate_tokens(messages)
+    while len(recent) > 2 and estimate_tokens(recent) > budget:
+        recent = recent[2:]
+
+    return messages + recent
+
+
+async def refresh_summary(session_id: str):
+    """Replie les scènes sorties de la fenêtre récente dans le résumé de la session"""
+    if CONTEXT_MODE != "compact":
+        return
+
+    session = get_session_store().get(session_id)
+    if session is None:
+        return
+
+    start = session.summarized_upto
+    upto = len(session.history) - 2 * CONTEXT_KEEP_TURNS
+    if upto <= start:
+        return
+
+    transcript = "\n\n".join(
+        f"{'Joueur' if turn.role is Role.USER else 'Narrateur'} : {turn.content}"
+        for turn in session.history[start:upto]
+    )
+    try:
+        response = await create_completion(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": (
+                    f"Résumé actuel :\n{session.summary or '(aucun)'}\n\n"
+                    f"Nouvelles scènes :\n{transcript}"
+                )},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+    except Exception:
+        logger.warning("⚠️ Résumé non mis à jour pour la session %s", session_id, exc_info=True)
+        return
+
+    # La session a pu changer pendant l'appel (reset, nouveau tour) : on relit avant d'écrire
+    session = get_session_store().get(session_id)
+    if session is None or session.summarized_upto != start or len(session.history) < upto:
+        return
+    summary = response.choices[0].message.content.strip()
+    # Écriture à part, sans changer la version : un tour en cours sur un autre worker
+    # n'est jamais refusé à cause du résumé
+    if not get_session_store().save_summary(session_id, summary, start, upto, session.version):
+        logger.info("↩️ Résumé abandonné pour la session %s (réinitialisée ou déjà résumée)", session_id)
+
+
+class PromptCacheStats:
+    """Compteurs de tokens de prompt servis depuis le cache de préfixe du fournisseur"""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def uncached_tokens(self) -> int:
+        return self.prompt_tokens - self.cached_tokens
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def record(self, usage) -> int:
+        """Ajoute l'usage d'une réponse et renvoie le nombre de tokens servis depuis le cache"""
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        return cached_tokens
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+def log_token_usage(session_id: str, session: Session, messages: List[dict], usage):
+    """Journalise les tokens envoyés pour chaque requête (estimation locale + chiffres de l'API)"""
+    cached_tokens = prompt_cache_stats.record(usage)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    if prompt_tokens is not None:
+        PROMPT_TOKENS.inc("true", amount=cached_tokens)
+        PROMPT_TOKENS.inc("false", amount=prompt_tokens - cached_tokens)
+        PROMPT_TOKENS_BY_SCENE.observe(prompt_tokens, str(session.scene_count))
+        COMPLETION_TOKENS.inc(amount=getattr(usage, "completion_tokens", None) or 0)
+    logger.info(
+        "🧮 session=%s scène=%s mode=%s messages=%d tokens_estimés=%d prompt_tokens=%s "
+        "cached_tokens=%d completion_tokens=%s cache_global=%.0f%%",
+        session_id,
+        session.scene_count,
+        CONTEXT_MODE,
+        len(messages),
+        estimate_tokens(messages),
+        getattr(usage, "prompt_tokens", None),
+        cached_tokens,
+        getattr(usage, "completion_tokens", None),
+        prompt_cache_stats.hit_ratio * 100,
+    )
+
+
+# === CONSIGNES PAR SCÈNE (précalculées au chargement) ===
+# Les consignes de chaque phase sont figées une fois pour toutes : le préfixe
+# [personnalité + consignes de la phase] est identique octet pour octet entre les tours
+# et entre les sessions, ce qui permet au fournisseur de réutiliser son cache de préfixe.
+# Seul l'état de la session (numéro de scène, choix) est placé à la fin, juste avant le message.
+
+def output_phase(session: Session, is_choice: bool) -> str:
+    """Phase de la scène que le tour va produire (la session n'est pas encore mise à jour) :
+    intro (scène 0), middle (1 à 8), climax (9), finale (10).
+
+    Choisit les consignes, le modèle et les règles de validation du tour : le choix du
+    personnage produit la première scène (middle), le choix de la scène 9 l'épilogue (finale).
+    """
+    scene = session.scene_count + 1 if is_choice and session.scene_count < 10 else session.scene_count
+    if scene == 0:
+        return "intro"
+    if scene == 9:
+        return "climax"
+    if scene >= 10:
+        return "finale"
+    return "middle"
+
+
+_FINALE_BANNER = "🔴" * 30
+
+SCENE_RULES = MappingProxyType({
+    "intro": "⚠️ Tu dois d'abord demander le choix du personnage avant de commencer l'histoire.",
+    "middle": (
+        "✅ L'utilisateur a fait son choix. Continue l'histoire de manière cohérente "
+        "et propose 3 nouveaux choix (1), (2), (3)."
+    ),
+    "climax": "\n".join([
+        "⚠️ ATTENTION : La PROCHAINE scène (scène 10) sera la FINALE. Prépare un climax.",
+        "✅ Pour cette scène 9, propose encore 3 choix numérotés (1), (2), (3).",
+    ]),
+    "finale": "\n".join([
+        _FINALE_BANNER,
+        "🔴🔴🔴 SCÈNE 10/10 - FINALE ABSOLUE 🔴🔴🔴",
+        _FINALE_BANNER,
+        "",
+        "❌ INTERDICTIONS ABSOLUES - JAMAIS DE CHOIX :",
+        "   ❌ N'ÉCRIS PAS (1)",
+        "   ❌ N'ÉCRIS PAS (2)",
+        "   ❌ N'ÉCRIS PAS (3)",
+        "   ❌ NE PROPOSE AUCUN CHOIX, AUCUNE OPTION",
+        "   ❌ NE POSE AUCUNE QUESTION À L'UTILISATEUR",
+        "   ❌ NE DIS PAS 'Que voulez-vous faire ?'",
+        "   ❌ NE DIS PAS 'Quel est votre choix ?'",
+        "   ❌ NE DIS PAS 'Choisissez'",
+        "   ❌ NE DIS PAS 'vous avez trois choix'",
+        "   ❌ NE DIS PAS 'vous avez plusieurs options'",
+        "   ❌ NE DIS PAS 'choisissez parmi'",
+        "   ❌ NE SUGGÈRES AUCUN CHOIX À L'UTILISATEUR",
+        "",
+        "✅ CE QUE TU DOIS FAIRE - OBLIGATOIRE :",
+        "   ✅ RACONTE UNIQUEMENT la conclusion finale de l'histoire",
+        "   ✅ RACONTE UNIQUEMENT CE QUI SE PASSE, PAS CE QUE L'UTILISATEUR DOIT FAIRE",
+        "   ✅ TERMINE l'aventure de manière définitive",
+        "   ✅ LAISSE l'utilisateur dans une situation finale, SANS SUGGÉRER d'action",
+        "   ✅ ÉCRIS 'FIN' ou 'L'histoire se termine ici' à la fin",
+        "   ✅ ARRÊTE-TOI APRÈS la conclusion. POINT FINAL.",
+        "",
+        "🔴 RAPPEL CRITIQUE : C'est un RÉCIT FINAL PUR.",
+        "   Tu racontes ce qui se passe, l'épilogue",
+        "   TU NE demandes RIEN à l'utilisateur",
+        "   TU NE suggères AUCUNE action à l'utilisateur",
+        "   TU NE proposes AUCUNE décision à prendre",
+        "   C'est la fin du récit, point final",
+        "",
+        "⚠️ C'EST LA DERNIÈRE SCÈNE. L'HISTOIRE EST FINIE. "
+        "AUCUNE interaction n'est possible après. CONCLUSION DÉFINITIVE.",
+        _FINALE_BANNER,
+    ]),
+})
+
+# Préfixe stable de chaque phase : (personnalité, consignes de la phase)
+PROMPT_PREFIXES = MappingProxyType({
+    phase: (AI_PERSONALITY, f"📍 CONSIGNES DE LA SCÈNE :\n{rules}")
+    for phase, rules in SCENE_RULES.items()
+})
+PREFIX_TOKENS = MappingProxyType({
+    phase: estimate_tokens([{"content": content} for content in prefix])
+    for phase, prefix in PROMPT_PREFIXES.items()
+})
+
+SCENE_STATE_TEMPLATE = (
+    "📍 CONTEXTE ACTUEL :\n"
+    "- Scène numéro : {scene}/10\n"
+    "- L'utilisateur a fait son choix : {chosen}\n"
+    "- Personnage choisi : {character}"
+)
+
+
+def build_context_messages(session: Session, user_message: str, is_choice: bool) -> List[dict]:
+    """Construit les messages avec le contexte de la session et les consignes de la scène à produire"""
+    phase = output_phase(session, is_choice)
+    personality, rules = PROMPT_PREFIXES[phase]
+
+    # Préfixe stable (mis en cache par le fournisseur)
+    messages = [
+        {"role": "system", "content": personality},
+        {"role": "system", "content": rules},
+    ]
+
+    # État de la session + message de l'utilisateur, toujours en dernier
+    scene_state = SCENE_STATE_TEMPLATE.format(
+        scene=session.scene_count,
+        chosen='Oui' if session.has_chosen else 'Non',
+        character='Oui' if session.character_chosen else 'Non (demande d abord)',
+    )
+    tail = [
+        {"role": "system", "content": scene_state},
+        {"role": "user", "content": user_message},
+    ]
+
+    # Ajoute l'historique des interactions (complet ou compacté)
+    messages.extend(select_history(session, PREFIX_TOKENS[phase] + estimate_tokens(tail)))
+    messages.extend(tail)
+
+    return messages
+
+
+# === CACHE DES SCÈNES D'OUVERTURE ===
+# Une nouvelle aventure commence toujours par le même message dans une session vide,
+# et la bonne réponse est toujours la question du choix du personnage : on garde un petit
+# pool de variantes déjà générées plutôt que de refaire un aller-retour vers le modèle.
+OPENING_MESSAGE = "Salut, démarre une aventure."
+OPENING_CACHE_VARIANTS = int(os.getenv("SPACESCENES_OPENING_CACHE_VARIANTS", "3"))
+OPENING_CACHE_MAX_KEYS = int(os.getenv("SPACESCENES_OPENING_CACHE_MAX_KEYS", "64"))
+OPENING_CACHE_PREWARM = os.getenv("SPACESCENES_OPENING_CACHE_PREWARM", "1") == "1"
+
+# Version du prompt : change dès que la personnalité ou les consignes de scène changent
+PROMPT_VERSION = hashlib.sha256(
+    "\x00".join(part for prefix in PROMPT_PREFIXES.values() for part in prefix).encode()
+).hexdigest()[:12]
+
+
+def normalize_message(message: str) -> str:
+    """Normalise un message pour la clé de cache (casse, espaces, ponctuation finale)"""
+    return " ".join(message.lower().split()).rstrip(" .!?…")
+
+
+class OpeningCache:
+    """Cache LRU des réponses pour les états déterministes du début d'aventure"""
+
+    def __init__(self, variants: int, max_keys: int, prompt_version: str):
+        self.variants = variants
+        self.max_keys = max_keys
+        self.prompt_version = prompt_version
+        self._pools: "OrderedDict[tuple, List[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, session: Session, message: str) -> Optional[tuple]:
+        """Clé de cache, ou None si l'état de la session n'est pas déterministe"""
+        if session.scene_count != 0 or session.character_chosen or session.history:
+            return None
+        return (session.scene_count, session.character_chosen, normalize_message(message), self.prompt_version)
+
+    def get(self, key: tuple) -> Optional[str]:
+        """Renvoie une variante au hasard, seulement une fois le pool complet"""
+        pool = self._pools.get(key)
+        if pool is None or len(pool) < self.variants or key[-1] != self.prompt_version:
+            self.misses += 1
+            return None
+        self._pools.move_to_end(key)
+        self.hits += 1
+        return random.choice(pool)
+
+    def put(self, key: tuple, response: str):
+        if key[-1] != self.prompt_version or not response:
+            return
+        pool = self._pools.setdefault(key, [])
+        self._pools.move_to_end(key)
+        if len(pool) < self.variants:
+            pool.append(response)
+        while len(self._pools) > self.max_keys:
+            self._pools.popitem(last=False)
+
+    def invalidate(self, prompt_version: Optional[str] = None):
+        """Vide le cache ; à appeler quand AI_PERSONALITY ou les consignes changent"""
+        self._pools.clear()
+        if prompt_version is not None:
+            self.prompt_version = prompt_version
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+
+opening_cache = OpeningCache(OPENING_CACHE_VARIANTS, OPENING_CACHE_MAX_KEYS, PROMPT_VERSION)
+
+
+async def prewarm_opening_cache():
+    """Pré-génère les variantes de la scène d'ouverture au démarrage"""
+    empty_session = Session()
+    key = opening_cache.key(empty_session, OPENING_MESSAGE)
+    is_choice = is_choice_message(OPENING_MESSAGE)
+    messages = build_context_messages(empty_session, OPENING_MESSAGE, is_choice)
+    route = model_router.routes[output_phase(empty_session, is_choice)]
+    try:
+        for _ in range(opening_cache.variants):
+            response = await create_completion(route, messages=messages)
+            # Validée une fois ici : une variante du cache ne coûte plus aucun appel ensuite
+            scene_text = await ensure_valid_scene(empty_session, is_choice, response.choices[0].message.content)
+            opening_cache.put(key, scene_text)
+    except Exception:
+        logger.warning("⚠️ Pré-génération des scènes d'ouverture interrompue", exc_info=True)
+        return
+    logger.info("✨ %d variantes de la scène d'ouverture prêtes", opening_cache.variants)
+
+
+# === PRÉ-GÉNÉRATION SPÉCULATIVE ===
+# Pendant que le joueur lit la scène, on génère en tâche de fond les trois scènes suivantes
+# possibles. Quand le choix arrive, la branche correspondante est servie immédiatement
+# et les deux autres sont annulées ou jetées.
+SPECULATIVE_MODE = os.getenv("SPACESCENES_SPECULATIVE", "0") == "1"
+SPECULATIVE_TOKEN_BUDGET = int(os.getenv("SPACESCENES_SPECULATIVE_TOKEN_BUDGET", "20000"))
+# On ne spécule que si le scheduler a de la marge (fraction des appels simultanés autorisés)
+SPECULATIVE_MAX_LOAD = float(os.getenv("SPACESCENES_SPECULATIVE_MAX_LOAD", "0.5"))
+
+CHOICE_NUMBER_RE = re.compile(r"\((\d+)\)")
+
+
+def parse_choice(prompt: str) -> Optional[int]:
+    """Extrait le numéro du choix du message de l'utilisateur"""
+    match = CHOICE_NUMBER_RE.search(prompt)
+    if match:
+        return int(match.group(1))
+    if prompt.strip() in ["1", "2", "3"]:
+        return int(prompt.strip())
+    return None
+
+
+def total_tokens(usage) -> int:
+    return getattr(usage, "total_tokens", None) or 0
+
+
+class Speculation:
+    """Branches en cours de génération pour une session, à partir d'un état donné"""
+
+    __slots__ = ("base", "tasks", "expires_at")
+
+    def __init__(self, base: int, tasks: Dict[int, asyncio.Task], expires_at: float = 0.0):
+        self.base = base  # longueur de l'historique au lancement
+        self.tasks = tasks
+        self.expires_at = expires_at
+
+
+class SpeculativeGenerator:
+    """Génère à l'avance les scènes suivantes de chaque session, dans un budget de tokens par session.
+
+    Les branches d'une session abandonnée expirent avec elle, après ttl secondes (SESSION_TTL).
+    """
+
+    def __init__(self, enabled: bool, token_budget: int, max_load: float, max_sessions: int, ttl: float):
+        self.enabled = enabled
+        self.token_budget = token_budget
+        self.max_load = max_load
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._speculations: "OrderedDict[str, Speculation]" = OrderedDict()
+        self._spent: "OrderedDict[str, int]" = OrderedDict()
+        self.launched = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.used_tokens = 0
+        self.wasted_tokens = 0
+        self.expired = 0
+
+    @property
+    def hit_rate(self) -> float:
+        taken = self.hits + self.misses
+        return self.hits / taken if taken else 0.0
+
+    def _purge_expired(self, now: float):
+        # Ordre d'insertion = ordre d'expiration (schedule retire l'ancienne entrée avant d'ajouter)
+        while self._speculations:
+            session_id, speculation = next(iter(self._speculations.items()))
+            if speculation.expires_at > now:
+                break
+            del self._speculations[session_id]
+            self._discard(speculation)
+            self.expired += 1
+
+    def _has_capacity(self) -> bool:
+        return scheduler.queued == 0 and scheduler.inflight < scheduler.max_inflight * self.max_load
+
+    def schedule(self, session_id: str, session: Session):
+        """Lance la génération des trois branches suivantes de la session"""
+        self.drop(session_id)
+        now = time.monotonic()
+        self._purge_expired(now)
+        if not self.enabled or session.scene_count >= 10 or not self._has_capacity():
+            return
+        if self._spent.get(session_id, 0) >= self.token_budget:
+            return
+
+        tasks = {}
+        route = model_router.select(output_phase(session, True))
+        for choice in (1, 2, 3):
+            messages = build_context_messages(session, f"Je choisis l'option ({choice})", True)
+            tasks[choice] = asyncio.create_task(self._generate(session_id, route, messages))
+        self.launched += len(tasks)
+
+        self._speculations[session_id] = Speculation(len(session.history), tasks, now + self.ttl)
+        while len(self._speculations) > self.max_sessions:
+            _, evicted = self._speculations.popitem(last=False)
+            self._discard(evicted)
+
+    async def _generate(self, session_id: str, route: ModelRoute, messages: List[dict]):
+        response = await create_completion(route, messages=messages)
+        self._spent[session_id] = self._spent.get(session_id, 0) + total_tokens(response.usage)
+        self._spent.move_to_end(session_id)
+        while len(self._spent) > self.max_sessions:
+            self._spent.popitem(last=False)
+        return response
+
+    async def take(self, session_id: str, session: Session, choice: Optional[int]):
+        """Renvoie la réponse pré-générée pour ce choix, ou None si elle n'existe pas"""
+        self._purge_expired(time.monotonic())
+        speculation = self._speculations.pop(session_id, None)
+        if speculation is None:
+            return None
+        task = speculation.tasks.pop(choice, None)
+        self._discard(speculation)
+        if task is None or speculation.base != len(session.history):
+            if task is not None:
+                self._discard(Speculation(speculation.base, {choice: task}))
+            self.misses += 1
+            return None
+
+        try:
+            response = await task
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used_tokens += total_tokens(response.usage)
+        return response
+
+    def _discard(self, speculation: Speculation):
+        """Annule les branches encore en cours et compte les tokens des branches terminées"""
+        for task in speculation.tasks.values():
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+            elif not task.cancelled() and task.exception() is None:
+                self.wasted_tokens += total_tokens(task.result().usage)
+
+    def drop(self, session_id: str):
+        speculation = self._speculations.pop(session_id, None)
+        if speculation is not None:
+            self._discard(speculation)
+
+    async def close(self):
+        """Arrêt du worker : annule toutes les branches en cours"""
+        tasks = [task for speculation in self._speculations.values() for task in speculation.tasks.values()]
+        for session_id in list(self._speculations):
+            self.drop(session_id)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+speculator = SpeculativeGenerator(
+    SPECULATIVE_MODE, SPECULATIVE_TOKEN_BUDGET, SPECULATIVE_MAX_LOAD, MAX_SESSIONS, SESSION_TTL
+)
+
+
+# === FRONTEND (page d'accueil et fichiers statiques) ===
+# Le frontend vit dans static/ : chargé une fois au démarrage, compressé à l'avance
+# (gzip, et brotli si installé) et servi avec un ETag fort. Les liens vers app.css / app.js
+# portent l'empreinte de leur contenu (?v=...) et restent donc en cache un an ;
+# la page elle-même est revalidée à chaque visite (304 si rien n'a changé).
+STATIC_DIR = os.getenv("SPACESCENES_STATIC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+STATIC_MAX_AGE = int(os.getenv("SPACESCENES_STATIC_MAX_AGE", str(365 * 24 * 3600)))
+STATIC_INDEX = "index.html"
+STATIC_MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+}
+
+
+class StaticAsset:
+    """Fichier du frontend et ses variantes précompressées"""
+
+    __slots__ = ("media_type", "version", "variants")
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if BROTLI_AVAILABLE:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Meilleur encodage accepté par le client (brotli, puis gzip)"""
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return "identity"
+
+    def etag(self, encoding: str) -> str:
+        # ETag fort : un par représentation
+        if encoding == "identity":
+            return f'"{self.version}"'
+        return f'"{self.version}-{encoding}"'
+
+
+def load_static_assets(directory: str) -> Dict[str, StaticAsset]:
+    """Charge le frontend ; les liens de la page pointent vers les URL empreintes"""
+    assets = {}
+    for name in sorted(os.listdir(directory)):
+        extension = os.path.splitext(name)[1]
+        if name == STATIC_INDEX or extension not in STATIC_MEDIA_TYPES:
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            assets[name] = StaticAsset(f.read(), STATIC_MEDIA_TYPES[extension])
+
+    with open(os.path.join(directory, STATIC_INDEX), encoding="utf-8") as f:
+        page = f.read()
+    for name, asset in assets.items():
+        page = page.replace(f'"/static/{name}"', f'"/static/{name}?v={asset.version}"')
+    assets[STATIC_INDEX] = StaticAsset(page.encode("utf-8"), STATIC_MEDIA_TYPES[".html"])
+    return assets
+
+
+# Chargés (et compressés) au démarrage du worker, pas à l'import
+static_assets: Optional[Dict[str, StaticAsset]] = None
+
+
+def get_static_assets() -> Dict[str, StaticAsset]:
+    """Frontend chargé au démarrage du worker (ou au premier besoin)"""
+    global static_assets
+    if static_assets is None:
+        static_assets = load_static_assets(STATIC_DIR)
+    return static_assets
+
+
+def static_response(request: Request, asset: StaticAsset, cache_control: str) -> Response:
+    """Sert la variante adaptée au client, ou 304 si sa copie est à jour"""
+    encoding = asset.negotiate(request.headers.get("accept-encoding", ""))
+    etag = asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
+
+
+@app.get("/", response_class=HTMLResponse)
+def home(request: Request):
+    return static_response(request, get_static_assets()[STATIC_INDEX], "no-cache")
+
+
+@app.get("/static/{name}")
+def static_file(name: str, request: Request, v: Optional[str] = None):
+    asset = get_static_assets().get(name)
+    if asset is None or name == STATIC_INDEX:
+        raise HTTPException(status_code=404, detail="Fichier introuvable.")
+    # URL empreinte : ce contenu ne changera plus jamais à cette adresse
+    if v == asset.version:
+        cache_control = f"public, max-age={STATIC_MAX_AGE}, immutable"
+    else:
+        cache_control = "no-cache"
+    return static_response(request, asset, cache_control)
+
+
+def is_choice_message(prompt: str) -> bool:
+    """Détecte si le message de l'utilisateur est un choix numéroté"""
+    return "choisis l'option" in prompt.lower() or prompt.strip() in ["1", "2", "3"]
+
+
+# === ANALYSE DES SCÈNES ===
+# Phrases qui demandent un choix au joueur : interdites dans la finale
+CHOICE_REQUEST_PHRASES = (
+    'que voulez-vous', 'que souhaitez-vous', 'quel est votre choix',
+    'que faites-vous', 'quelle décision', 'comment réagissez-vous',
+    'choisissez', 'décidez', 'à vous de', 'vous devez faire un choix',
+    'vous devez choisir', 'faite un choix', 'faire un choix',
+    'quelle est votre décision', 'à vous de décider', 'décidez maintenant',
+)
+
+# Un seul automate pour toute la finale : choix numérotés (1) à (19) ou phrase interdite.
+# Il s'applique à la ligne en minuscules (re.IGNORECASE est nettement plus lent en Unicode).
+FINALE_REJECT_RE = re.compile(
+    r"\((?:[1-9]|1[0-9])\)|" + "|".join(re.escape(phrase) for phrase in CHOICE_REQUEST_PHRASES)
+)
+
+# Ligne de choix : "(1) Texte", éventuellement entourée de markdown ("**(1)** Texte", "- (1) : Texte")
+CHOICE_LINE_RE = re.compile(r"^[\s*_>-]*\((\d+)\)[\s*_.:)-]*(.*?)[\s*_]*$")
+
+# Choix dans le fil d'une phrase, comme la question du personnage imposée par AI_PERSONALITY :
+# "Souhaitez-vous incarner un homme (1) ou une femme (2) ou un être moins facile à définir (3)?"
+INLINE_CHOICE_RE = re.compile(r"\((\d+)\)")
+INLINE_CHOICE_LEAD_RE = re.compile(r"^(?:.*[.:?!]\s+)?(?:\S+-vous\s+\S+\s+)?(?:\s*(?:,|ou|et)\s+)*", re.DOTALL)
+
+FINALE_FOOTER = (
+    "\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    "🌌 ✨ FIN DE VOTRE AVENTURE ✨ 🌌\n"
+    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+)
+
+
+def keep_finale_line(line: str) -> bool:
+    """Une ligne de la finale est gardée si elle n'est pas vide et ne propose aucun choix"""
+    return bool(line.strip()) and FINALE_REJECT_RE.search(line.lower()) is None
+
+
+def filter_finale(ai_response: str) -> str:
+    """Supprime choix et questions de la scène 10, puis ajoute le message de fin"""
+    ai_response = '\n'.join(filter(keep_finale_line, ai_response.split('\n'))).strip()
+    # Forcer un message de fin explicite
+    if ai_response:
+        ai_response += FINALE_FOOTER
+    return ai_response
+
+
+def parse_inline_choices(text: str) -> List[dict]:
+    """Choix (1), (2), (3)… écrits dans une phrase ; [] si la numérotation ne part pas de 1 sans trou"""
+    for line in reversed(text.split('\n')):
+        parts = INLINE_CHOICE_RE.split(line)
+        numbers = [int(number) for number in parts[1::2]]
+        if len(numbers) < 2 or numbers != list(range(1, len(numbers) + 1)):
+            continue
+        # Texte d'un choix : ce qui précède son numéro, sans le début de phrase ni « ou » / « , »
+        return [
+            {"id": number, "text": INLINE_CHOICE_LEAD_RE.sub("", segment).strip()}
+            for number, segment in zip(numbers, parts[0::2])
+        ]
+    return []
+
+
+def parse_scene(text: str, is_final: bool) -> dict:
+    """Découpe une scène en champs structurés : narration, choix [{id, text}], finale ou non"""
+    if is_final:
+        return {"narrative": text, "choices": [], "is_final": True}
+
+    narrative_lines = []
+    choices = []
+    for line in text.split('\n'):
+        match = CHOICE_LINE_RE.match(line)
+        if match:
+            choices.append({"id": int(match.group(1)), "text": match.group(2)})
+        elif not choices:
+            narrative_lines.append(line)
+
+    narrative = '\n'.join(narrative_lines).strip()
+    if not choices:
+        # Question du personnage : les choix sont dans la phrase, qui reste dans la narration
+        choices = parse_inline_choices(narrative)
+    return {"narrative": narrative, "choices": choices, "is_final": False}
+
+
+class SceneStreamParser:
+    """Version incrémentale de parse_scene / filter_finale pour les réponses en streaming.
+
+    feed() renvoie le texte affichable tout de suite : tel quel pour une scène normale,
+    ligne par ligne (après filtrage) pour la finale.
+    """
+
+    def __init__(self, is_final: bool):
+        self.is_final = is_final
+        self.choices: List[dict] = []
+        self._partial = ""
+        self._started = False
+
+    def _complete_line(self, line: str) -> str:
+        if not self.is_final:
+            match = CHOICE_LINE_RE.match(line)
+            if match:
+                self.choices.append({"id": int(match.group(1)), "text": match.group(2)})
+            return ""
+        if not keep_finale_line(line):
+            return ""
+        out = line if not self._started else '\n' + line
+        self._started = True
+        return out
+
+    def feed(self, chunk: str) -> str:
+        self._partial += chunk
+        *lines, self._partial = self._partial.split('\n')
+        emitted = "".join(self._complete_line(line) for line in lines)
+        return emitted if self.is_final else chunk
+
+    def close(self) -> str:
+        line, self._partial = self._partial, ""
+        emitted = self._complete_line(line)
+        return emitted if self.is_final else ""
+
+
+def ends_in_finale(session: Session, is_choice: bool) -> bool:
+    """Indique si la réponse en cours de génération sera la scène 10 (avant la mise à jour de la session)"""
+    return session.scene_count == 10 or (is_choice and session.scene_count == 9)
+
+
+# === VALIDATION ET RÉPARATION DES SCÈNES ===
+# Chaque scène générée est vérifiée avant d'être enregistrée : exactement trois choix (1) (2) (3),
+# rien après le dernier choix, aucun choix dans la finale. En cas de défaut :
+#   - texte après des choix corrects → coupé localement ;
+#   - choix absents ou mal numérotés → courte complétion qui n'écrit que les trois choix,
+#     à partir de la fin de la narration déjà générée (sans l'historique) ;
+#   - choix dans la finale → supprimés par filter_finale, comme avant.
+SCENE_REPAIR = os.getenv("SPACESCENES_SCENE_REPAIR", "1") == "1"
+REPAIR_MODEL = os.getenv("SPACESCENES_REPAIR_MODEL", DEFAULT_MODEL)
+REPAIR_MAX_TOKENS = int(os.getenv("SPACESCENES_REPAIR_MAX_TOKENS", "150"))
+REPAIR_CONTEXT_CHARS = int(os.getenv("SPACESCENES_REPAIR_CONTEXT_CHARS", "1500"))
+REPAIR_INSTRUCTIONS = (
+    "Voici la fin d'une scène d'aventure interactive de science-fiction. "
+    "Écris UNIQUEMENT les trois choix qui la terminent, un par ligne, exactement sous la forme :\n"
+    "(1) Texte du premier choix\n(2) Texte du deuxième choix\n(3) Texte du troisième choix\n"
+    "Aucun autre texte, aucune introduction, aucune question."
+)
+
+
+def validate_scene(text: str, phase: str) -> Optional[str]:
+    """Motif du premier défaut de format de la scène (phase vue par output_phase), ou None si elle est conforme"""
+    lines = text.rstrip().split('\n')
+    if phase == "finale":
+        if any(line.strip() and not keep_finale_line(line) for line in lines):
+            return "choices_in_finale"
+        return None
+
+    choice_lines = [index for index, line in enumerate(lines) if CHOICE_LINE_RE.match(line)]
+    if not choice_lines:
+        # La question du personnage porte ses choix dans la phrase, comme l'exige AI_PERSONALITY
+        if phase == "intro" and [choice["id"] for choice in parse_inline_choices(text)] == [1, 2, 3]:
+            return None
+        return "missing_choices"
+    if [int(CHOICE_LINE_RE.match(lines[index]).group(1)) for index in choice_lines] != [1, 2, 3]:
+        return "choice_count"
+    if any(line.strip() for line in lines[choice_lines[-1] + 1:]):
+        return "text_after_choices"
+    return None
+
+
+async def repair_scene(text: str, reason: str, complete) -> tuple:
+    """Corrige une scène (hors finale) ; renvoie (texte, "trimmed" | "repaired")"""
+    lines = text.rstrip().split('\n')
+    if reason == "text_after_choices":
+        last_choice = max(index for index, line in enumerate(lines) if CHOICE_LINE_RE.match(line))
+        return '\n'.join(lines[:last_choice + 1]), "trimmed"
+
+    narrative = '\n'.join(line for line in lines if not CHOICE_LINE_RE.match(line)).strip()
+    response = await complete(
+        model=REPAIR_MODEL,
+        messages=[
+            {"role": "system", "content": REPAIR_INSTRUCTIONS},
+            {"role": "user", "content": narrative[-REPAIR_CONTEXT_CHARS:]},
+        ],
+        max_tokens=REPAIR_MAX_TOKENS,
+    )
+    COMPLETION_TOKENS.inc(amount=getattr(response.usage, "completion_tokens", None) or 0)
+    choices = [
+        line.strip() for line in response.choices[0].message.content.split('\n') if CHOICE_LINE_RE.match(line)
+    ]
+    return narrative + "\n\n" + '\n'.join(choices), "repaired"
+
+
+async def ensure_valid_scene(session: Session, is_choice: bool, text: str, complete=None) -> str:
+    """Valide la scène avant son enregistrement et la répare si besoin.
+
+    complete : fonction d'appel à l'API pour la réparation (create_completion par défaut ;
+    upstream.complete quand l'appelant occupe déjà une place du scheduler).
+    """
+    phase = output_phase(session, is_choice)
+    reason = validate_scene(text, phase)
+    SCENE_VALIDATIONS.inc(phase, "ok" if reason is None else "invalid")
+    if reason is None:
+        return text
+
+    SCENE_VALIDATION_FAILURES.inc(phase, reason)
+    if phase == "finale":
+        # filter_finale (dans apply_turn) retire les choix de la finale
+        SCENE_REPAIRS.inc(phase, "filtered")
+        return text
+    if not SCENE_REPAIR:
+        return text
+
+    try:
+        repaired, outcome = await repair_scene(text, reason, complete or create_completion)
+    except Exception:
+        logger.warning("⚠️ Réparation de scène impossible (%s)", reason, exc_info=True)
+        SCENE_REPAIRS.inc(phase, "failed")
+        return text
+    if validate_scene(repaired, phase) is not None:
+        SCENE_REPAIRS.inc(phase, "failed")
+        return text
+    logger.info("🩹 Scène réparée (%s → %s, phase %s)", reason, outcome, phase)
+    SCENE_REPAIRS.inc(phase, outcome)
+    return repaired
+
+
+def apply_turn(session: Session, prompt: str, is_choice: bool, ai_response: str) -> dict:
+    """Applique un tour à la session, nettoie la finale et construit la réponse JSON"""
+    # Sauvegarde dans l'historique
+    session.add_turn(Role.USER, prompt)
+    session.add_turn(Role.ASSISTANT, ai_response)
+
+    # Met à jour l'état de la session si un choix a été fait
+    if is_choice:
+        # Détecte si c'est le choix du personnage (scène 0)
+        if session.scene_count == 0:
+            session.character_chosen = True
+
+        # Ne pas incrémenter si on est déjà à la scène 10 (finale)
+        if session.scene_count < 10:
+            update_session_after_choice(session)
+            # Réinitialise has_chosen pour la prochaine scène
+            session.has_chosen = False
+
+    # 🔒 SÉCURITÉ MAXIMALE : Nettoyer la réponse pour la scène 10 finale
+    # On vérifie maintenant (après l'incrémentation) si on est à la scène 10
+    is_final = session.scene_count == 10
+    if is_final:
+        ai_response = filter_finale(ai_response)
+
+    return {
+        "response": ai_response,
+        **parse_scene(ai_response, is_final),
+        "debug": {
+            "sceneCount": session.scene_count,
+            "hasChosen": session.has_chosen,
+            "character_chosen": session.character_chosen
+        }
+    }
+
+
+def finalize_turn(session_id: str, session: Session, prompt: str, is_choice: bool, ai_response: str) -> dict:
+    """Applique le tour, puis enregistre la session dans le store et le journal"""
+    payload = apply_turn(session, prompt, is_choice, ai_response)
+    try:
+        get_session_store().save(session_id, session)
+    except SessionConflict:
+        # Même aventure jouée en parallèle sur un autre worker (ou réinitialisée) : ce tour est perdu
+        raise HTTPException(
+            status_code=409,
+            detail="Cette aventure a avancé entre-temps, rechargez-la pour continuer.",
+        )
+    adventure_journal = get_journal()
+    if adventure_journal:
+        adventure_journal.append_turn(session_id, session, prompt, ai_response)
+    return payload
+
+
+# === ROUTE /CHAT — pour parler à l'IA ===
+@app.post("/chat")
+async def chat(
+    user_message: ChatMessage,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None),
+):
+    prompt = user_message.message
     session_id = user_message.session_id
     
     if not prompt:
         raise HTTPException(status_code=400, detail="Le champ 'message' est requis.")
+    if len(prompt) > MAX_MESSAGE_CHARS:
+        raise HTTPException(status_code=413, detail=f"Message limité à {MAX_MESSAGE_CHARS} caractères.")
 
-    try:
-        # Récupère ou crée la session
-        session = get_or_create_session(session_id)
+    request_started = time.perf_counter()
+
+    async def play_turn() -> dict:
+        # Récupère ou crée la session (sous le verrou : personne d'autre ne joue ce tour)
+        with span("session_lookup"):
+            session = await get_or_create_session(session_id)
+        check_turn_allowed(session)
+        scene = str(session.scene_count)
         
         # Détecte si c'est un choix
-        is_choice = "choisis l'option" in prompt.lower() or prompt.strip() in ["1", "2", "3"]
+        is_choice = is_choice_message(prompt)
         
         # Construction des messages avec contexte
-        messages = build_context_messages(session, prompt)
-        
-        # Appel à l'API OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
+        with span("build_context"):
+            messages = build_context_messages(session, prompt, is_choice)
+
+        # Début d'aventure : réponse servie depuis le cache si possible
+        cache_key = opening_cache.key(session, prompt)
+        ai_response = opening_cache.get(cache_key) if cache_key else None
+
+        # Choix déjà pré-généré en tâche de fond
+        if ai_response is None and is_choice and speculator.enabled:
+            response = await speculator.take(session_id, session, parse_choice(prompt))
+            if response is not None:
+                ai_response = response.choices[0].message.content
+                log_token_usage(session_id, session, messages, response.usage)
+
+        if ai_response is None:
+            # Appel à l'API OpenAI (asynchrone, via le scheduler)
+            upstream_started = time.perf_counter()
+            response = await create_completion(
+                model_router.select(output_phase(session, is_choice)),
+                messages=messages,
+            )
+            upstream_elapsed = time.perf_counter() - upstream_started
+            CHAT_SPANS.observe(upstream_elapsed, "upstream")
+            UPSTREAM_TTFT.observe(upstream_elapsed, "chat")
+
+            ai_response = response.choices[0].message.content
+            log_token_usage(session_id, session, messages, response.usage)
+            fresh = True
+        else:
+            fresh = False
+
+        with span("validate"):
+            ai_response = await ensure_valid_scene(session, is_choice, ai_response)
+        if fresh and cache_key:
+            opening_cache.put(cache_key, ai_response)
+
+        # Le résumé est mis à jour après l'envoi de la réponse
+        background_tasks.add_task(refresh_summary, session_id)
+
+        with span("postprocess"):
+            payload = finalize_turn(session_id, session, prompt, is_choice, ai_response)
+        speculator.schedule(session_id, session)
+
+        CHAT_LATENCY.observe(time.perf_counter() - request_started, "chat", scene)
+        return payload
+
+    try:
+        async with admission.admit(request, session_id):
+            # Un double clic ou un client qui réessaie reçoit le résultat du même tour
+            key = session_gate.key(session_id, prompt, user_message.request_id or idempotency_key)
+            payload = await session_gate.run(key, session_id, play_turn)
+        CHAT_REQUESTS.inc("chat", "200")
+        return payload
+
+    except HTTPException as exc:
+        CHAT_REQUESTS.inc("chat", str(exc.status_code))
+        raise
+    except Exception as e:
+        CHAT_REQUESTS.inc("chat", "500")
+        logger.exception("❌ ERREUR /chat (session %s)", session_id)
+        raise HTTPException(status_code=500, detail=f"Erreur interne : {str(e)}")
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Formate un événement Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """Flux SSE qui ferme sa pile de ressources (admission, verrou, scheduler, flux amont)
+    même si le générateur n'a jamais démarré (client parti avant l'envoi des en-têtes)"""
+
+    def __init__(self, content, stack: AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.stack = stack
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Sans effet si le générateur a déjà refermé la pile
+            await self.stack.aclose()
+
+
+# === ROUTE /CHAT/STREAM — même chose que /chat, mais token par token (SSE) ===
+@app.post("/chat/stream")
+async def chat_stream(
+    user_message: ChatMessage,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None),
+):
+    prompt = user_message.message
+    session_id = user_message.session_id
+
+    if not prompt:
+        raise HTTPException(status_code=400, detail="Le champ 'message' est requis.")
+    if len(prompt) > MAX_MESSAGE_CHARS:
+        raise HTTPException(status_code=413, detail=f"Message limité à {MAX_MESSAGE_CHARS} caractères.")
+
+    request_started = time.perf_counter()
+
+    # La place accordée par le contrôle d'admission est gardée jusqu'à la fin du flux
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(admission.admit(request, session_id))
+    except HTTPException as exc:
+        CHAT_REQUESTS.inc("stream", str(exc.status_code))
+        raise
+
+    # Requête en double : on attend le tour déjà en cours et on renvoie la scène d'un bloc
+    key = session_gate.key(session_id, prompt, user_message.request_id or idempotency_key)
+    shared = session_gate.claim(key)
+    if shared is not None:
+        try:
+            payload = await asyncio.shield(shared)
+        except HTTPException as exc:
+            CHAT_REQUESTS.inc("stream", str(exc.status_code))
+            raise
+        finally:
+            await stack.aclose()
+
+        async def shared_events():
+            yield sse_event({"token": payload["response"]})
+            yield sse_event(payload, event="done")
+            CHAT_REQUESTS.inc("stream", "200")
+
+        return StreamingResponse(shared_events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    # Le verrou de la session est gardé jusqu'à la fin du flux (voir events())
+    try:
+        await stack.enter_async_context(session_gate.lock(session_id))
+        # Le verrou est relâché après la publication du résultat (pile LIFO)
+        stack.callback(
+            session_gate.resolve, key, error=HTTPException(status_code=503, detail="Tour interrompu, réessayez.")
         )
-        
-        ai_response = response.choices[0].message.content
-        
-        # Sauvegarde dans l'historique
-        session['history'].append({"role": "user", "content": prompt})
-        session['history'].append({"role": "assistant", "content": ai_response})
-        
-        # Met à jour l'état de la session si un choix a été fait
-        if is_choice:
-            # Détecte si c'est le choix du personnage (scène 0)
-            if session['sceneCount'] == 0:
-                session['character_chosen'] = True
-            
-            # Ne pas incrémenter si on est déjà à la scène 10 (finale)
-            if session['sceneCount'] < 10:
-                update_session_after_choice(session_id)
-                # Réinitialise hasChosen pour la prochaine scène
-                session['hasChosen'] = False
-        
-        # 🔒 SÉCURITÉ MAXIMALE : Nettoyer la réponse pour la scène 10 finale
-        # On vérifie maintenant (après l'incrémentation) si on est à la scène 10
-        if session['sceneCount'] == 10:
-            lines = ai_response.split('\n')
-            filtered_lines = []
-            
-            for line in lines:
-                line_lower = line.lower().strip()
-                # Supprimer les lignes contenant des choix numérotés
-                if any(f'({i})' in line for i in range(1, 20)):
-                    continue
-                # Supprimer les questions et phrases demandant un choix
-                if any(phrase in line_lower for phrase in [
-                    'que voulez-vous', 'que souhaitez-vous', 'quel est votre choix',
-                    'que faites-vous', 'quelle décision', 'comment réagissez-vous',
-                    'choisissez', 'décidez', 'à vous de', 'vous devez faire un choix',
-                    'vous devez choisir', 'faite un choix', 'faire un choix', 'quel est votre choix',
-                    'quelle est votre décision', 'à vous de décider', 'décidez maintenant'
-                ]):
-                    continue
-                # Supprimer les lignes vides consécutives
-                if line.strip():
-                    filtered_lines.append(line)
-            
-            ai_response = '\n'.join(filtered_lines).strip()
-            
-            # Forcer un message de fin explicite
-            if ai_response:
-                ai_response += "\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-                ai_response += "🌌 ✨ FIN DE VOTRE AVENTURE ✨ 🌌\n"
-                ai_response += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+        with span("session_lookup"):
+            session = await get_or_create_session(session_id)
+        check_turn_allowed(session)
+        scene = str(session.scene_count)
+        is_choice = is_choice_message(prompt)
+        with span("build_context"):
+            messages = build_context_messages(session, prompt, is_choice)
+
+        # Début d'aventure en cache ou choix pré-généré : la scène est envoyée d'un bloc
+        cache_key = opening_cache.key(session, prompt)
+        ready_response = opening_cache.get(cache_key) if cache_key else None
+        if ready_response is None and is_choice and speculator.enabled:
+            response = await speculator.take(session_id, session, parse_choice(prompt))
+            if response is not None:
+                ready_response = response.choices[0].message.content
+                log_token_usage(session_id, session, messages, response.usage)
+
+        if ready_response is None:
+            # La place dans le scheduler est réservée AVANT d'ouvrir le flux,
+            # pour pouvoir encore répondre un vrai 429/503 au client
+            await stack.enter_async_context(scheduler.slot())
+            route = model_router.select(output_phase(session, is_choice))
+            upstream_started = time.perf_counter()
+            try:
+                stream = await upstream.open_stream(
+                    messages=messages,
+                    stream_options={"include_usage": True},
+                    **route.params,
+                )
+            except HTTPException:
+                model_router.record(route, time.perf_counter() - upstream_started, error=True)
+                raise
+            stack.push_async_callback(stream.close)
+    except HTTPException as exc:
+        session_gate.resolve(key, error=exc)
+        await stack.aclose()
+        CHAT_REQUESTS.inc("stream", str(exc.status_code))
+        raise
+    except BaseException as e:
+        session_gate.resolve(key, error=e)
+        await stack.aclose()
+        if not isinstance(e, Exception):
+            raise
+        CHAT_REQUESTS.inc("stream", "500")
+        logger.exception("❌ ERREUR /chat/stream (session %s)", session_id)
+        raise HTTPException(status_code=500, detail=f"Erreur interne : {str(e)}")
+
+    if ready_response is not None:
+        async def ready_events():
+            async with stack:
+                parser = SceneStreamParser(ends_in_finale(session, is_choice))
+                yield sse_event({"token": parser.feed(ready_response) + parser.close()})
+                with span("validate"):
+                    scene_text = await ensure_valid_scene(session, is_choice, ready_response)
+                with span("postprocess"):
+                    payload = finalize_turn(session_id, session, prompt, is_choice, scene_text)
+                session_gate.resolve(key, payload)
+                yield sse_event(payload, event="done")
+                speculator.schedule(session_id, session)
+                CHAT_REQUESTS.inc("stream", "200")
+                CHAT_LATENCY.observe(time.perf_counter() - request_started, "stream", scene)
+
+        background_tasks.add_task(refresh_summary, session_id)
+        return ReleasingStreamingResponse(
+            ready_events(), stack, media_type="text/event-stream", headers=SSE_HEADERS,
+        )
+
+    parser = SceneStreamParser(ends_in_finale(session, is_choice))
+
+    async def events():
+        async with stack:
+            parts = []
+            usage = None
+            upstream_elapsed = None
+            try:
+                async for chunk in stream:
+                    # Le dernier morceau ne contient que l'usage des tokens
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if not parts:
+                            UPSTREAM_TTFT.observe(time.perf_counter() - upstream_started, "stream")
+                        parts.append(token)
+                        visible = parser.feed(token)
+                        if visible:
+                            yield sse_event({"token": visible})
+
+                visible = parser.close()
+                if visible:
+                    yield sse_event({"token": visible})
+                upstream_elapsed = time.perf_counter() - upstream_started
+                CHAT_SPANS.observe(upstream_elapsed, "upstream")
+                model_router.record(route, upstream_elapsed, usage)
+
+                log_token_usage(session_id, session, messages, usage)
+                # La place du scheduler est déjà occupée par ce flux : réparation via upstream directement
+                with span("validate"):
+                    scene_text = await ensure_valid_scene(session, is_choice, "".join(parts), upstream.complete)
+                if cache_key:
+                    opening_cache.put(cache_key, scene_text)
 
+                # Dernier événement : texte final (réparé, nettoyé pour la scène 10) + état de la session
+                with span("postprocess"):
+                    payload = finalize_turn(session_id, session, prompt, is_choice, scene_text)
+                session_gate.resolve(key, payload)
+                yield sse_event(payload, event="done")
+                speculator.schedule(session_id, session)
+                CHAT_REQUESTS.inc("stream", "200")
+                CHAT_LATENCY.observe(time.perf_counter() - request_started, "stream", scene)
+            except Exception as e:
+                if upstream_elapsed is None:
+                    # Flux coupé par l'API : compte comme une erreur de la route
+                    model_router.record(route, time.perf_counter() - upstream_started, error=True)
+                CHAT_REQUESTS.inc("stream", "error")
+                logger.exception("❌ ERREUR /chat/stream pendant le flux (session %s)", session_id)
+                yield sse_event({"detail": f"Erreur interne : {str(e)}"}, event="error")
+
+    # Le résumé est mis à jour une fois le flux terminé
+    background_tasks.add_task(refresh_summary, session_id)
+
+    return ReleasingStreamingResponse(events(), stack, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# === ROUTE /METRICS — métriques au format Prometheus ===
+metrics.gauge("spacescenes_ready", "1 quand le worker est prêt (voir /readyz)", lambda: int(worker_state.ready))
+metrics.gauge(
+    "spacescenes_active_sessions", "Sessions actives dans le store", lambda: len(session_store) if session_store else 0,
+)
+metrics.gauge("spacescenes_admission_active", "Tours admis en cours de traitement", lambda: admission.active)
+metrics.gauge("spacescenes_upstream_inflight", "Appels amont en cours", lambda: scheduler.inflight)
+metrics.gauge("spacescenes_upstream_queued", "Appels amont en file d'attente", lambda: scheduler.queued)
+metrics.counter_from("spacescenes_upstream_rejected_total", "Appels refusés, file pleine (429)", lambda: scheduler.rejected)
+metrics.counter_from("spacescenes_upstream_queue_timeouts_total", "Appels expirés dans la file (503)", lambda: scheduler.timed_out)
+metrics.counter_from("spacescenes_upstream_attempts_total", "Tentatives d'appel amont", lambda: upstream.attempts)
+metrics.counter_from("spacescenes_upstream_retries_total", "Nouvelles tentatives après erreur", lambda: upstream.retries)
+metrics.counter_from("spacescenes_upstream_failures_total", "Appels amont définitivement en échec", lambda: upstream.failures)
+metrics.counter_from("spacescenes_upstream_hedges_total", "Requêtes de couverture lancées", lambda: upstream.hedges)
+metrics.counter_from("spacescenes_upstream_hedge_wins_total", "Requêtes de couverture plus rapides", lambda: upstream.hedge_wins)
+metrics.counter_from("spacescenes_session_lock_waits_total", "Tours mis en attente derrière un autre tour de la même session", lambda: session_gate.waits)
+metrics.counter_from("spacescenes_coalesced_requests_total", "Requêtes en double fusionnées avec un tour en cours", lambda: session_gate.coalesced)
+metrics.counter_from("spacescenes_idempotent_replays_total", "Tours rejoués depuis une clé d'idempotence", lambda: session_gate.replayed)
+metrics.counter_from("spacescenes_route_fallbacks_total", "Appels servis par le modèle de repli", lambda: model_router.fallbacks)
+metrics.counter_from("spacescenes_route_degradations_total", "Passages d'une route sur son modèle de repli", lambda: model_router.degradations)
+metrics.counter_from("spacescenes_opening_cache_hits_total", "Scènes d'ouverture servies par le cache", lambda: opening_cache.hits)
+metrics.counter_from("spacescenes_opening_cache_misses_total", "Scènes d'ouverture générées", lambda: opening_cache.misses)
+metrics.counter_from("spacescenes_speculative_hits_total", "Choix servis par pré-génération", lambda: speculator.hits)
+metrics.counter_from("spacescenes_speculative_misses_total", "Choix sans pré-génération utilisable", lambda: speculator.misses)
+metrics.counter_from("spacescenes_speculative_wasted_tokens_total", "Tokens de branches jetées", lambda: speculator.wasted_tokens)
+metrics.counter_from("spacescenes_speculative_expired_total", "Pré-générations de sessions expirées", lambda: speculator.expired)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# === ROUTE /BATCH/ADVENTURES — génération d'aventures complètes hors ligne ===
+# Joue N parties complètes (politique de choix scriptée ou aléatoire) dans un pool de workers,
+# avec les mêmes build_context_messages / filtre de finale que /chat. Chaque partie terminée
+# est ajoutée en JSONL dans BATCH_OUTPUT_DIR. Pour tester sans coût : OPENAI_BASE_URL pointant
+# vers benchmarks/mock_openai.py.
+# Routes désactivées (404) tant que SPACESCENES_BATCH_TOKEN n'est pas défini ; chaque appel doit
+# alors présenter ce jeton dans l'en-tête X-Batch-Token. Les parties batch passent après les joueurs :
+# chaque scène attend que le scheduler soit sous BATCH_MAX_LOAD, comme la génération spéculative.
+BATCH_TOKEN = os.getenv("SPACESCENES_BATCH_TOKEN", "")
+BATCH_OUTPUT_DIR = os.getenv("SPACESCENES_BATCH_DIR", "batch_output")
+BATCH_MAX_ADVENTURES = int(os.getenv("SPACESCENES_BATCH_MAX_ADVENTURES", "1000"))
+BATCH_MAX_PARALLELISM = int(os.getenv("SPACESCENES_BATCH_MAX_PARALLELISM", "16"))
+BATCH_MAX_RUNNING_JOBS = int(os.getenv("SPACESCENES_BATCH_MAX_RUNNING_JOBS", "2"))
+BATCH_MAX_LOAD = float(os.getenv("SPACESCENES_BATCH_MAX_LOAD", "0.5"))
+BATCH_CAPACITY_POLL = 0.1  # secondes entre deux vérifications de la charge
+BATCH_MAX_JOBS = 100  # jobs terminés gardés en mémoire pour consultation
+
+
+class BatchRequest(BaseModel):
+    adventures: int = 10
+    parallelism: int = 4
+    policy: str = "random"  # "random" ou "scripted"
+    script: List[int] = []  # choix joués dans l'ordre (personnage puis scènes), répétés si trop courts
+    seed: Optional[int] = None
+
+
+class BatchJob:
+    """Suivi d'un job de génération"""
+
+    def __init__(self, job_id: str, request: BatchRequest, output_path: str):
+        self.job_id = job_id
+        self.request = request
+        self.output_path = output_path
+        self.status = "running"
+        self.completed = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
         return {
-            "response": ai_response,
-            "debug": {
-                "sceneCount": session['sceneCount'],
-                "hasChosen": session['hasChosen'],
-                "character_chosen": session['character_chosen']
-            }
+            "job_id": self.job_id,
+            "status": self.status,
+            "adventures": self.request.adventures,
+            "completed": self.completed,
+            "failed": self.failed,
+            "parallelism": self.request.parallelism,
+            "policy": self.request.policy,
+            "output_path": self.output_path,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
         }
 
-    except Exception as e:
-        import traceback
-        print("❌ ERREUR /chat :", traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Erreur interne : {str(e)}")
+
+batch_jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+
+
+def check_batch_token(token: Optional[str]):
+    """404 si le batch est désactivé, 403 si le jeton est absent ou faux"""
+    if not BATCH_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), BATCH_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Jeton batch invalide.")
+
+
+async def wait_for_batch_capacity():
+    """Attend que les joueurs laissent de la place dans le scheduler"""
+    while scheduler.queued or scheduler.inflight >= scheduler.max_inflight * BATCH_MAX_LOAD:
+        await asyncio.sleep(BATCH_CAPACITY_POLL)
+
+
+def next_choice(request: BatchRequest, step: int, payload: dict, rng: random.Random) -> int:
+    """Choix joué par la politique du job"""
+    if request.policy == "scripted":
+        return request.script[step % len(request.script)]
+    return rng.choice([choice["id"] for choice in payload["choices"]] or [1, 2, 3])
+
+
+async def play_batch_adventure(request: BatchRequest, rng: random.Random) -> List[dict]:
+    """Joue une partie complète (démarrage, personnage, neuf choix) sur une session privée"""
+    session = Session()
+    message = OPENING_MESSAGE
+    scenes = []
+    for step in range(11):
+        is_choice = is_choice_message(message)
+        messages = build_context_messages(session, message, is_choice)
+        await wait_for_batch_capacity()
+        response = await create_completion(model_router.select(output_phase(session, is_choice)), messages=messages)
+        scene_text = await ensure_valid_scene(session, is_choice, response.choices[0].message.content)
+        payload = apply_turn(session, message, is_choice, scene_text)
+        scenes.append({"message": message, **payload})
+        if payload["is_final"]:
+            break
+        message = f"Je choisis l'option ({next_choice(request, step, payload, rng)})"
+    return scenes
+
+
+async def run_batch_job(job: BatchJob):
+    request = job.request
+    rng = random.Random(request.seed)
+    semaphore = asyncio.Semaphore(request.parallelism)
+
+    async def worker(index: int, output):
+        async with semaphore:
+            try:
+                scenes = await play_batch_adventure(request, random.Random(rng.random()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                job.failed += 1
+                logger.warning("⚠️ Batch %s : aventure %d en échec (%s)", job.job_id, index, exc)
+                return
+            line = json.dumps({"job_id": job.job_id, "index": index, "scenes": scenes}, ensure_ascii=False)
+            output.write(line + "\n")
+            output.flush()
+            job.completed += 1
+
+    workers = []
+    try:
+        with open(job.output_path, "a", encoding="utf-8") as output:
+            workers = [asyncio.create_task(worker(index, output)) for index in range(request.adventures)]
+            await asyncio.gather(*workers)
+        job.status = "completed"
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+    except Exception:
+        logger.exception("❌ Batch %s interrompu", job.job_id)
+        job.status = "failed"
+    finally:
+        # gather() annulé rend la main dès la première annulation : on attend tous les workers
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        job.finished_at = time.time()
+
+
+@app.post("/batch/adventures", status_code=202)
+async def create_batch_job(request: BatchRequest, x_batch_token: Optional[str] = Header(None)):
+    check_batch_token(x_batch_token)
+    if not 1 <= request.adventures <= BATCH_MAX_ADVENTURES:
+        raise HTTPException(status_code=400, detail=f"'adventures' doit être entre 1 et {BATCH_MAX_ADVENTURES}.")
+    if not 1 <= request.parallelism <= BATCH_MAX_PARALLELISM:
+        raise HTTPException(status_code=400, detail=f"'parallelism' doit être entre 1 et {BATCH_MAX_PARALLELISM}.")
+    if request.policy not in ("random", "scripted"):
+        raise HTTPException(status_code=400, detail="'policy' doit valoir 'random' ou 'scripted'.")
+    if request.policy == "scripted" and (not request.script or any(c not in (1, 2, 3) for c in request.script)):
+        raise HTTPException(status_code=400, detail="'script' doit contenir des choix 1, 2 ou 3.")
+    running = sum(job.status == "running" for job in batch_jobs.values())
+    if running >= BATCH_MAX_RUNNING_JOBS:
+        raise HTTPException(
+            status_code=429, detail=f"{running} jobs déjà en cours, réessayez plus tard.", headers={"Retry-After": "60"},
+        )
+
+    os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex[:12]
+    job = BatchJob(job_id, request, os.path.join(BATCH_OUTPUT_DIR, f"{job_id}.jsonl"))
+    job.task = asyncio.create_task(run_batch_job(job))
+
+    batch_jobs[job_id] = job
+    while len(batch_jobs) > BATCH_MAX_JOBS:
+        oldest_id, oldest = next(iter(batch_jobs.items()))
+        if oldest.status == "running":
+            break
+        del batch_jobs[oldest_id]
+    return job.to_dict()
+
+
+@app.get("/batch/adventures/{job_id}")
+async def get_batch_job(job_id: str, x_batch_token: Optional[str] = Header(None)):
+    check_batch_token(x_batch_token)
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable")
+    return job.to_dict()
+
+
+@app.delete("/batch/adventures/{job_id}")
+async def cancel_batch_job(job_id: str, x_batch_token: Optional[str] = Header(None)):
+    check_batch_token(x_batch_token)
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable")
+    if job.status == "running":
+        job.task.cancel()
+        try:
+            await job.task
+        except asyncio.CancelledError:
+            pass
+    return job.to_dict()
 
 
 # === ROUTE /RESET — pour réinitialiser une session ===
 @app.post("/reset")
 async def reset_session(request: dict):
     session_id = request.get("session_id", "default")
-    if session_id in sessions:
-        del sessions[session_id]
+    get_session_store().delete(session_id)
+    speculator.drop(session_id)
+    adventure_journal = get_journal()
+    if adventure_journal:
+        # Le marqueur doit être sur disque avant de répondre : les autres workers
+        # reprendraient sinon l'ancienne aventure depuis le journal
+        written = adventure_journal.append_reset(session_id)
+        await asyncio.to_thread(written.wait, JOURNAL_RESET_TIMEOUT)
     return {"message": "Session réinitialisée", "session_id": session_id}
 
 
+# === ROUTE /RESUME — pour reprendre une aventure (même après un redémarrage) ===
+@app.get("/resume/{session_id}")
+async def resume_session(session_id: str):
+    session = await restore_session(session_id)
+    if session is None or not session.history:
+        raise HTTPException(status_code=404, detail="Aucune aventure à reprendre")
+
+    # Dernière scène, telle qu'elle a été affichée au joueur
+    last_scene = session.history[-1].content
+    is_final = session.scene_count == 10
+    if is_final:
+        last_scene = filter_finale(last_scene)
+    return {
+        "session_id": session_id,
+        "response": last_scene,
+        **parse_scene(last_scene, is_final),
+        "debug": {
+            "sceneCount": session.scene_count,
+            "hasChosen": session.has_chosen,
+            "character_chosen": session.character_chosen
+        }
+    }
+
+
 # === ROUTE /STATUS — pour vérifier l'état d'une session ===
 @app.get("/status/{session_id}")
 async def get_status(session_id: str):
-    if session_id not in sessions:
+    session = get_session_store().get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session introuvable")
     
-    session = sessions[session_id]
     return {
         "session_id": session_id,
-        "sceneCount": session['sceneCount'],
-        "hasChosen": session['hasChosen'],
-        "character_chosen": session['character_chosen'],
-        "history_length": len(session['history'])
+        "sceneCount": session.scene_count,
+        "hasChosen": session.has_chosen,
+        "character_chosen": session.character_chosen,
+        "history_length": len(session.history)
     }
 
 
+# === SONDES /HEALTHZ ET /READYZ (orchestrateur) ===
+@app.get("/healthz")
+async def healthz():
+    """Le processus répond (liveness)"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Prêt à recevoir des joueurs : client amont créé et pool chauffé (readiness)"""
+    if not worker_state.ready:
+        raise HTTPException(status_code=503, detail=worker_state.detail, headers={"Retry-After": "1"})
+    return {"status": "ready", "startup_seconds": round(worker_state.startup_seconds, 3)}
+
+
 # === FIN DU FICHIER ===
-print("🚀 SpaceScenes API lancée avec ChatGPT — ready to fly among the stars 🌌")
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Micro-benchmark du filtre de la scène 10 : ancienne version (substrings) vs automate précompilé.
+
+Usage :
+    python benchmarks/bench_scene_filter.py [--repeat 2000]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app import SceneStreamParser, filter_finale, parse_scene  # noqa: E402
+
+
+def legacy_filter_finale(ai_response: str) -> str:
+    """Implémentation d'origine de chat() : range(1, 20) et any() imbriqués, ligne par ligne"""
+    lines = ai_response.split('\n')
+    filtered_lines = []
+
+    for line in lines:
+        line_lower = line.lower().strip()
+        if any(f'({i})' in line for i in range(1, 20)):
+            continue
+        if any(phrase in line_lower for phrase in [
+            'que voulez-vous', 'que souhaitez-vous', 'quel est votre choix',
+            'que faites-vous', 'quelle décision', 'comment réagissez-vous',
+            'choisissez', 'décidez', 'à vous de', 'vous devez faire un choix',
+            'vous devez choisir', 'faite un choix', 'faire un choix', 'quel est votre choix',
+            'quelle est votre décision', 'à vous de décider', 'décidez maintenant'
+        ]):
+            continue
+        if line.strip():
+            filtered_lines.append(line)
+
+    ai_response = '\n'.join(filtered_lines).strip()
+    if ai_response:
+        ai_response += "\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+        ai_response += "🌌 ✨ FIN DE VOTRE AVENTURE ✨ 🌌\n"
+        ai_response += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+    return ai_response
+
+
+FINALE = "\n".join(
+    ["Le vaisseau glisse enfin vers la nébuleuse d'Orion, ses moteurs réduits au silence."] * 30
+    + ["", "Que voulez-vous faire maintenant ?", "(1) Rentrer", "(2) Repartir", "(3) Rester", "",
+       "L'histoire se termine ici... FIN"]
+)
+SCENE = "\n".join(
+    ["La station orbitale vibre sous les impacts des débris, les alarmes hurlent."] * 20
+    + ["", "(1) Rejoindre la passerelle", "(2) Descendre aux hangars", "(3) Couper l'alimentation"]
+)
+
+
+def legacy_parse_choices(text: str) -> list:
+    """Ce que faisait le client : text.match(/\\(\\d+\\)/g) sur tout le texte"""
+    return re.findall(r"\(\d+\)", text)
+
+
+def bench(label: str, func, repeat: int):
+    seconds = timeit.timeit(func, number=repeat)
+    print(f"{label:<42} {seconds / repeat * 1e6:>9.1f} µs/appel")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    assert filter_finale(FINALE) == legacy_filter_finale(FINALE), "les deux filtres divergent"
+
+    print(f"Finale : {len(FINALE)} caractères, scène : {len(SCENE)} caractères, {args.repeat} répétitions\n")
+    legacy = bench("filtre finale (ancien)", lambda: legacy_filter_finale(FINALE), args.repeat)
+    compiled = bench("filtre finale (automate précompilé)", lambda: filter_finale(FINALE), args.repeat)
+    print(f"{'→ accélération':<42} {legacy / compiled:>9.1f}x\n")
+
+    bench("regex client (ancien, texte brut)", lambda: legacy_parse_choices(SCENE), args.repeat)
+    bench("parse_scene (champs structurés)", lambda: parse_scene(SCENE, False), args.repeat)
+
+    def streamed():
+        stream_parser = SceneStreamParser(is_final=True)
+        for i in range(0, len(FINALE), 16):
+            stream_parser.feed(FINALE[i:i + 16])
+        stream_parser.close()
+
+    bench("SceneStreamParser finale (morceaux de 16)", streamed, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Mémoire occupée par une session : ancien dict + historique brut vs Session compacte.
+
+Mesure par tracemalloc sur N sessions, à la scène 1, 5 et 10. Les scènes sont assemblées à partir
+de quelques phrases types : elles se compressent mieux qu'un vrai texte généré, compter plutôt
+un facteur 2 à 3 sur la partie compressée en production.
+
+Usage :
+    python benchmarks/bench_session_memory.py [--sessions 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app import Role, Session  # noqa: E402
+
+SENTENCES = [
+    "Le vaisseau glisse entre deux lunes mortes, ses boucliers crépitant sous la pluie de débris.",
+    "Une voix synthétique annonce l'arrivée imminente d'une patrouille de l'Hégémonie.",
+    "Dans la soute, la cargaison clandestine émet une lueur bleutée inquiétante.",
+    "Votre copilote, Kaël, serre les dents en recalibrant les propulseurs auxiliaires.",
+    "Au loin, la station Méridian clignote comme un phare au milieu de la nébuleuse.",
+]
+OPENING = ("Souhaitez-vous incarner un homme (1) ou une femme (2) ou un être moins facile à définir (3)?\n"
+           "(1) Un homme\n(2) Une femme\n(3) Un être moins facile à définir")
+
+
+def scene_text(rng: random.Random) -> str:
+    """Scène réaliste d'environ 1 800 caractères suivie de trois choix"""
+    narrative = " ".join(rng.choice(SENTENCES) for _ in range(20))
+    return narrative + "\n\n(1) Foncer vers la station\n(2) Larguer la cargaison\n(3) Affronter la patrouille"
+
+
+def turns(scene: int, rng: random.Random) -> list:
+    """Historique (rôle, texte) d'une session arrivée à la scène donnée"""
+    history = [("user", "Salut, démarre une aventure."), ("assistant", OPENING)]
+    for _ in range(scene):
+        history.append(("user", f"Je choisis l'option ({rng.randint(1, 3)})"))
+        history.append(("assistant", scene_text(rng)))
+    return history
+
+
+def legacy_session(scene: int, history: list) -> dict:
+    """Représentation d'origine : dict + liste de dicts {role, content}"""
+    return {
+        "sceneCount": scene,
+        "hasChosen": False,
+        # Les textes sont recopiés comme s'ils venaient d'une réponse JSON (pas de partage)
+        "history": [{"role": "".join(role), "content": "".join(content)} for role, content in history],
+        "character_chosen": scene > 0,
+    }
+
+
+def compact_session(scene: int, history: list) -> Session:
+    session = Session(scene_count=scene, character_chosen=scene > 0)
+    for role, content in history:
+        session.add_turn(Role(role), "".join(content))
+    return session
+
+
+def bytes_per_session(build, scene: int, count: int, seed: int) -> float:
+    rng = random.Random(seed)
+    histories = [turns(scene, rng) for _ in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [build(scene, history) for history in histories]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sessions
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'scène':>6} {'dict (o/session)':>18} {'Session (o/session)':>20} {'gain':>7}")
+    for scene in (1, 5, 10):
+        legacy = bytes_per_session(legacy_session, scene, args.sessions, args.seed)
+        compact = bytes_per_session(compact_session, scene, args.sessions, args.seed)
+        print(f"{scene:>6} {legacy:>18,.0f} {compact:>20,.0f} {legacy / compact:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
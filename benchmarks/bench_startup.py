@@ -0,0 +1,124 @@
+"""Benchmark du démarrage d'un worker : temps d'import de app.py et délai avant /readyz = 200.
+
+1. Import : `import app` dans un processus neuf, sans OPENAI_API_KEY (l'import ne doit ni
+   échouer ni toucher au réseau), répété --runs fois ; médiane comparée au budget --budget-ms.
+   Les modules les plus lourds sont listés d'après `python -X importtime`.
+2. Démarrage : un worker uvicorn branché sur le faux backend (benchmarks/mock_openai.py),
+   chronométré du lancement du processus jusqu'au premier 200 de /readyz (pool chauffé).
+
+Usage :
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 1500
+Code de sortie 1 si la médiane d'import dépasse le budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+from multiworker_demo import ROOT, free_port, wait_until_up  # noqa: E402
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def import_env(workdir: str) -> dict:
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    env["SPACESCENES_JOURNAL_PATH"] = os.path.join(workdir, "journal.db")
+    env["SPACESCENES_SESSION_DB"] = os.path.join(workdir, "sessions.db")
+    return env
+
+
+def measure_import(runs: int, env: dict) -> list:
+    durations = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+        durations.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return durations
+
+
+def heaviest_imports(env: dict, top: int) -> list:
+    """Imports directs de app.py classés par durée cumulée (µs)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:  # importé directement par app
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def measure_boot(workdir: str) -> float:
+    """Secondes entre le lancement d'uvicorn et le premier 200 de /readyz"""
+    mock_port = free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "mock_openai.py"), "--port", str(mock_port)],
+    )
+    worker = None
+    try:
+        wait_until_up(f"http://127.0.0.1:{mock_port}/v1/models")
+        port = free_port()
+        env = {
+            **import_env(workdir),
+            "OPENAI_API_KEY": "mock",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+            "SPACESCENES_OPENING_CACHE_PREWARM": "0",
+        }
+        started = time.perf_counter()
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        while time.perf_counter() - started < 60:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/readyz", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError("/readyz n'est jamais passé à 200")
+    finally:
+        for process in (worker, mock):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps de démarrage d'un worker SpaceScenes")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="budget pour la médiane d'import (ms)")
+    parser.add_argument("--top", type=int, default=8, help="nombre de modules lourds à afficher")
+    parser.add_argument("--skip-boot", action="store_true", help="ne mesure que l'import")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = import_env(workdir)
+        durations = measure_import(args.runs, env)
+        median = statistics.median(durations)
+        print(f"📦 import app (sans clé d'API) : médiane {median:.0f} ms, "
+              f"min {min(durations):.0f} ms, max {max(durations):.0f} ms  (budget {args.budget_ms:.0f} ms)")
+        for cumulative, name in heaviest_imports(env, args.top):
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+        if not args.skip_boot:
+            print(f"🚦 lancement uvicorn → /readyz 200 : {measure_boot(workdir):.2f} s")
+
+    if median > args.budget_ms:
+        print("❌ budget d'import dépassé")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Test de charge : parties complètes de 10 scènes jouées en parallèle contre l'app SpaceScenes.
+
+L'app et un faux backend OpenAI (benchmarks/mock_openai.py) tournent dans le même processus,
+reliés par httpx.ASGITransport : on mesure le worker lui-même, sans réseau ni coût d'API.
+Chaque partie enchaîne : démarrage → choix du personnage → neuf choix (11 requêtes).
+
+Usage :
+    python benchmarks/load_test.py --adventures 200 --concurrency 50 --ttft 0.3 --tokens-per-second 80
+    python benchmarks/load_test.py --endpoint stream --json > bench_output.json
+
+Rapport : latence p50/p95/p99 par scène, requêtes/s, retard de la boucle d'événements, croissance du RSS.
+Un appel bloquant dans chat() se voit immédiatement dans le retard de boucle et le débit.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+# Tous les joueurs simulés partagent une IP et enchaînent les scènes sans pause :
+# les seaux à jetons sont coupés sauf demande explicite
+os.environ.setdefault("SPACESCENES_RATE_LIMIT_IP_RATE", "0")
+os.environ.setdefault("SPACESCENES_RATE_LIMIT_SESSION_RATE", "0")
+
+import httpx  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+import app as spacescenes  # noqa: E402
+from mock_openai import MockSettings, create_mock_app  # noqa: E402
+
+START_MESSAGE = "Salut, démarre une aventure."
+
+
+def percentile(values: list, q: float) -> float:
+    """Percentile par rang le plus proche"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def rss_bytes() -> int:
+    """Mémoire résidente actuelle (Linux), sinon pic de RSS"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def install_fake_backend(settings: MockSettings):
+    """Remplace le client amont de l'app par le faux backend, monté en mémoire"""
+    transport = httpx.ASGITransport(app=create_mock_app(settings))
+    spacescenes.client = AsyncOpenAI(
+        api_key="mock",
+        base_url="http://mock/v1",
+        http_client=httpx.AsyncClient(transport=transport),
+        max_retries=0,
+    )
+
+
+class LoopLagMonitor:
+    """Mesure le retard de la boucle d'événements (réveil d'un sleep périodique)"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: list = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def send(http: httpx.AsyncClient, endpoint: str, message: str, session_id: str) -> dict:
+    payload = {"message": message, "session_id": session_id}
+    if endpoint == "chat":
+        response = await http.post("/chat", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    result = None
+    async with http.stream("POST", "/chat/stream", json=payload) as response:
+        response.raise_for_status()
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "done":
+                result = json.loads(line[6:])
+            elif not line:
+                event = None
+    if result is None:
+        raise RuntimeError("flux terminé sans événement 'done'")
+    return result
+
+
+async def play_adventure(http, endpoint: str, think_time: float, stats: dict):
+    """Joue une partie complète et enregistre la latence de chaque scène"""
+    session_id = f"bench_{uuid.uuid4().hex[:12]}"
+    message = START_MESSAGE
+    for _ in range(11):
+        started = time.perf_counter()
+        try:
+            data = await send(http, endpoint, message, session_id)
+        except Exception as exc:
+            stats["errors"][type(exc).__name__] += 1
+            return
+        scene = data["debug"]["sceneCount"]
+        stats["latency"][scene].append(time.perf_counter() - started)
+        stats["requests"] += 1
+        if data.get("is_final"):
+            stats["completed"] += 1
+            return
+        choice = random.choice([c["id"] for c in data.get("choices") or [{"id": 1}]])
+        message = f"Je choisis l'option ({choice})"
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run(args) -> dict:
+    install_fake_backend(MockSettings(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        scene_tokens=args.scene_tokens,
+        error_rate=args.error_rate,
+    ))
+    stats = {"latency": defaultdict(list), "requests": 0, "completed": 0, "errors": defaultdict(int)}
+    monitor = LoopLagMonitor()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def player():
+        async with semaphore:
+            await play_adventure(http, args.endpoint, args.think_time, stats)
+
+    transport = httpx.ASGITransport(app=spacescenes.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://spacescenes", timeout=None) as http:
+        rss_before = rss_bytes()
+        monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(player() for _ in range(args.adventures)))
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+        rss_after = rss_bytes()
+
+    lag_ms = [lag * 1000 for lag in monitor.samples]
+    return {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "requests": stats["requests"],
+        "requests_per_s": round(stats["requests"] / elapsed, 2) if elapsed else 0.0,
+        "adventures_completed": stats["completed"],
+        "errors": dict(stats["errors"]),
+        "latency_ms": {
+            scene: {
+                "count": len(values),
+                "p50": round(percentile(values, 50) * 1000, 1),
+                "p95": round(percentile(values, 95) * 1000, 1),
+                "p99": round(percentile(values, 99) * 1000, 1),
+            }
+            for scene, values in sorted(stats["latency"].items())
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag_ms, 50), 2),
+            "p99": round(percentile(lag_ms, 99), 2),
+            "max": round(max(lag_ms, default=0.0), 2),
+        },
+        "rss_mb": {
+            "before": round(rss_before / 2**20, 1),
+            "after": round(rss_after / 2**20, 1),
+            "growth": round((rss_after - rss_before) / 2**20, 1),
+        },
+    }
+
+
+def print_report(report: dict):
+    print(f"⏱  {report['requests']} requêtes en {report['elapsed_s']} s → {report['requests_per_s']} req/s")
+    print(f"🏁 {report['adventures_completed']}/{report['config']['adventures']} aventures terminées, "
+          f"erreurs : {report['errors'] or 'aucune'}\n")
+    print(f"{'scène':>6} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scene, row in report["latency_ms"].items():
+        print(f"{scene:>6} {row['count']:>6} {row['p50']:>9} {row['p95']:>9} {row['p99']:>9}")
+    lag = report["loop_lag_ms"]
+    rss = report["rss_mb"]
+    print(f"\n🔁 retard de boucle : p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+    print(f"🧠 RSS : {rss['before']} → {rss['after']} Mo ({rss['growth']:+} Mo)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge SpaceScenes avec faux backend")
+    parser.add_argument("--adventures", type=int, default=100, help="nombre de parties à jouer")
+    parser.add_argument("--concurrency", type=int, default=20, help="parties jouées en parallèle")
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="chat")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause du joueur entre deux scènes (s)")
+    parser.add_argument("--ttft", type=float, default=0.2, help="latence du premier token du faux backend (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--scene-tokens", type=int, default=250)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="rapport JSON sur la sortie standard")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
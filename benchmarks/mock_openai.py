@@ -0,0 +1,190 @@
+"""Faux serveur compatible OpenAI (/v1/chat/completions) pour tester SpaceScenes sans appel payant.
+
+Latence du premier token, débit de tokens et taux d'erreurs (429 / 5xx) sont réglables, ce qui
+permet d'exercer les retries, le hedging et le streaming de l'application.
+
+Serveur autonome :
+    python benchmarks/mock_openai.py --port 8001 --ttft 0.3 --tokens-per-second 80
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock uvicorn app:app
+
+En mémoire (sans socket), pour les benchmarks :
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_mock_app(settings)))
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "le vaisseau dérive vers une nébuleuse pourpre tandis que les alarmes résonnent dans la coursive "
+    "un signal inconnu traverse le cockpit et l'équipage retient son souffle face aux étoiles"
+).split()
+
+
+@dataclass
+class MockSettings:
+    ttft: float = 0.2                # secondes avant le premier token
+    tokens_per_second: float = 100.0 # débit de génération
+    scene_tokens: int = 250          # longueur de la narration d'une scène
+    error_rate: float = 0.0          # proportion de requêtes en erreur
+    error_status: int = 429          # code renvoyé pour ces erreurs
+    seed: int = 0
+
+
+CHOICE_LINES = "(1) Foncer vers le signal\n(2) Se cacher dans la ceinture d'astéroïdes\n(3) Appeler la flotte"
+
+
+def is_choice(message: str) -> bool:
+    return "choisis l'option" in message.lower() or message.strip() in ("1", "2", "3")
+
+
+def scene_text(messages: list, n_tokens: int, rng: random.Random) -> str:
+    """Texte plausible selon la requête : réparation, résumé, ouverture, scène ou finale"""
+    system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    if "UNIQUEMENT les trois choix" in system:
+        # Réparation d'une scène : les lignes de choix seules, qui tiennent dans max_tokens
+        return CHOICE_LINES
+    narrative = " ".join(rng.choice(WORDS) for _ in range(n_tokens)).capitalize() + "."
+    if "Tu tiens le résumé" in system:
+        return narrative
+    last_user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    started = any(m.get("role") == "assistant" for m in messages)
+    if not started and not is_choice(last_user):
+        # Ouverture : format exigé par AI_PERSONALITY, les trois choix dans la question
+        return "Souhaitez-vous incarner un homme (1) ou une femme (2) ou un être moins facile à définir (3)?"
+    if "SCÈNE 10/10" in system:
+        return narrative + "\n\nL'histoire se termine ici... FIN"
+    return narrative + "\n\n" + CHOICE_LINES
+
+
+def split_tokens(text: str) -> list:
+    """Découpe le texte en « tokens » (mots + espace), comme un flux réel"""
+    words = text.split(" ")
+    return [w + " " for w in words[:-1]] + [words[-1]]
+
+
+def usage_payload(messages: list, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(m.get("content", "")) // 4 + 4 for m in messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+def create_mock_app(settings: MockSettings) -> FastAPI:
+    mock = FastAPI(title="Mock OpenAI")
+    rng = random.Random(settings.seed)
+    mock.state.settings = settings
+    mock.state.requests = 0
+
+    @mock.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        mock.state.requests += 1
+        messages = body.get("messages", [])
+        model = body.get("model", "mock")
+
+        if rng.random() < settings.error_rate:
+            await asyncio.sleep(settings.ttft)
+            return JSONResponse(
+                status_code=settings.error_status,
+                content={"error": {"message": "mock error", "type": "mock", "code": settings.error_status}},
+                headers={"retry-after": "0"} if settings.error_status == 429 else None,
+            )
+
+        tokens = split_tokens(scene_text(messages, settings.scene_tokens, rng))
+        if body.get("max_tokens"):
+            tokens = tokens[: body["max_tokens"]]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        per_token = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(settings.ttft + per_token * len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage_payload(messages, len(tokens)),
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events():
+            await asyncio.sleep(settings.ttft)
+            for i, token in enumerate(tokens):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": token} if i == 0 else {"content": token},
+                        "finish_reason": None,
+                    }],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if per_token:
+                    await asyncio.sleep(per_token)
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            if include_usage:
+                usage = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [], "usage": usage_payload(messages, len(tokens)),
+                }
+                yield f"data: {json.dumps(usage)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @mock.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "mock"}]}
+
+    return mock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur OpenAI pour SpaceScenes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=MockSettings.ttft)
+    parser.add_argument("--tokens-per-second", type=float, default=MockSettings.tokens_per_second)
+    parser.add_argument("--scene-tokens", type=int, default=MockSettings.scene_tokens)
+    parser.add_argument("--error-rate", type=float, default=MockSettings.error_rate)
+    parser.add_argument("--error-status", type=int, default=MockSettings.error_status)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    settings = MockSettings(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        scene_tokens=args.scene_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    uvicorn.run(create_mock_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
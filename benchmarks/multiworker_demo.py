@@ -0,0 +1,153 @@
+"""Démo multi-processus : une aventure complète qui rebondit d'un worker à l'autre.
+
+Lance le faux backend OpenAI (benchmarks/mock_openai.py) et N processus uvicorn de l'app,
+chacun sur son port, tous branchés sur le même store SQLite (SPACESCENES_SESSION_STORE=sqlite).
+Chaque requête de la partie part vers le worker suivant (round-robin, aucune affinité) :
+la partie doit aller jusqu'à la scène 10 sans perdre son histoire.
+Ensuite, deux choix envoyés en même temps à deux workers différents pour la même session :
+le verrouillage optimiste n'en garde qu'un, l'autre reçoit 409.
+
+Usage :
+    python benchmarks/multiworker_demo.py --workers 3
+Code de sortie 1 si la course ne donne pas exactement un 200 et un 409.
+"""
+import argparse
+import concurrent.futures
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+START_MESSAGE = "Salut, démarre une aventure."
+# Délai avant le premier token du faux backend : assez long pour que les deux requêtes
+# de la course soient toujours en vol en même temps
+MOCK_TTFT = 0.2
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} ne répond pas")
+
+
+def start_processes(workers: int, workdir: str):
+    processes = []
+    mock_port = free_port()
+    processes.append(subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "mock_openai.py"),
+         "--port", str(mock_port), "--ttft", str(MOCK_TTFT), "--tokens-per-second", "2000"],
+    ))
+    wait_until_up(f"http://127.0.0.1:{mock_port}/v1/models")
+
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "SPACESCENES_SESSION_STORE": "sqlite",
+        "SPACESCENES_SESSION_DB": os.path.join(workdir, "sessions.db"),
+        "SPACESCENES_JOURNAL_PATH": os.path.join(workdir, "journal.db"),
+        "SPACESCENES_OPENING_CACHE_PREWARM": "0",
+        "SPACESCENES_RATE_LIMIT_IP_RATE": "0",
+        "SPACESCENES_RATE_LIMIT_SESSION_RATE": "0",
+    }
+    urls = []
+    for _ in range(workers):
+        port = free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        ))
+        urls.append(f"http://127.0.0.1:{port}")
+    for url in urls:
+        wait_until_up(f"{url}/metrics")
+    return processes, urls
+
+
+def play_bouncing_adventure(urls: list) -> str:
+    """Joue une partie complète, chaque requête sur le worker suivant"""
+    session_id = f"demo_{uuid.uuid4().hex[:8]}"
+    message = START_MESSAGE
+    for step in range(11):
+        url = urls[step % len(urls)]
+        res = httpx.post(f"{url}/chat", json={"message": message, "session_id": session_id}, timeout=30)
+        res.raise_for_status()
+        data = res.json()
+        print(f"  requête {step + 1:2d} → {url}  scène {data['debug']['sceneCount']:2d}"
+              f"  final={data['is_final']}")
+        if data["is_final"]:
+            break
+        message = "Je choisis l'option (1)"
+
+    assert data["is_final"] and data["debug"]["sceneCount"] == 10, "la partie n'est pas allée au bout"
+    # L'histoire complète est visible depuis n'importe quel worker
+    for url in urls:
+        status = httpx.get(f"{url}/status/{session_id}").json()
+        assert status["sceneCount"] == 10, f"{url} voit la scène {status['sceneCount']}"
+    return session_id
+
+
+def race_same_session(urls: list) -> list:
+    """Deux choix simultanés sur deux workers pour la même session"""
+    session_id = f"race_{uuid.uuid4().hex[:8]}"
+    httpx.post(f"{urls[0]}/chat", json={"message": START_MESSAGE, "session_id": session_id}, timeout=30)
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        futures = [
+            pool.submit(
+                httpx.post, f"{url}/chat",
+                json={"message": f"Je choisis l'option ({choice})", "session_id": session_id}, timeout=30,
+            )
+            for choice, url in zip((1, 2), (urls[0], urls[1 % len(urls)]))
+        ]
+    statuses = sorted(future.result().status_code for future in futures)
+    scene = httpx.get(f"{urls[0]}/status/{session_id}").json()["sceneCount"]
+    print(f"  statuts : {statuses}, scène enregistrée : {scene}")
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Une aventure SpaceScenes répartie sur plusieurs workers")
+    parser.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        processes, urls = start_processes(args.workers, workdir)
+        try:
+            print(f"🛰  Aventure répartie sur {len(urls)} workers :")
+            session_id = play_bouncing_adventure(urls)
+            print(f"✅ {session_id} terminée, histoire intacte sur tous les workers")
+
+            print("⚔️  Deux choix simultanés pour la même session :")
+            statuses = race_same_session(urls)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+    if statuses != [200, 409]:
+        print(f"❌ attendu [200, 409], obtenu {statuses}")
+        sys.exit(1)
+    print("✅ un seul tour enregistré, l'autre refusé (409)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+let isWriting = false;
+// L'identifiant est conservé dans le navigateur pour pouvoir reprendre l'aventure
+const SESSION_ID = localStorage.getItem('spacescenes_session_id')
+  || 'user_' + Math.random().toString(36).substr(2, 9);
+localStorage.setItem('spacescenes_session_id', SESSION_ID);
+
+// Clé d'idempotence d'un tour : (aventure, scène affichée, message). Deux envois du même
+// choix pour la même scène partagent la clé, le serveur ne joue le tour qu'une fois
+let adventureId = newAdventureId();
+let currentScene = 0;
+
+function newAdventureId() {
+  return Date.now().toString(36) + Math.random().toString(36).substr(2, 6);
+}
+
+// Reprise de l'aventure en cours au chargement de la page
+window.addEventListener('load', async () => {
+  const res = await fetch(`/resume/${encodeURIComponent(SESSION_ID)}`);
+  if (!res.ok) return;
+  const data = await res.json();
+  updateDebug(data);
+  document.getElementById('story').textContent = data.response;
+  showChoices(data);
+});
+
+function updateDebug(data) {
+  if (data.debug) {
+    currentScene = data.debug.sceneCount;
+    document.getElementById('debug-scene').textContent = data.debug.sceneCount;
+    document.getElementById('debug-chosen').textContent = data.debug.hasChosen ? 'Oui' : 'Non';
+    document.getElementById('debug-character').textContent = data.debug.character_chosen ? 'Oui' : 'Non';
+  }
+}
+
+async function startAdventure() {
+  if (isWriting) return;
+
+  const storyDiv = document.getElementById('story');
+  storyDiv.innerHTML = "Chargement de la première scène...<br>";
+
+  isWriting = true;
+
+  // Une nouvelle aventure repart de zéro, même après une partie terminée ou reprise
+  adventureId = newAdventureId();
+  currentScene = 0;
+  await fetch('/reset', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({ session_id: SESSION_ID })
+  });
+  document.getElementById('choices').style.display = "none";
+
+  await streamScene('Salut, démarre une aventure.', storyDiv, true);
+
+  isWriting = false;
+}
+
+async function resetAdventure() {
+  const res = await fetch('/reset', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({ session_id: SESSION_ID })
+  });
+
+  adventureId = newAdventureId();
+  currentScene = 0;
+  document.getElementById('story').innerHTML = "";
+  document.getElementById('choices').style.display = "none";
+  document.getElementById('debug-scene').textContent = "0";
+  document.getElementById('debug-chosen').textContent = "Non";
+  document.getElementById('debug-character').textContent = "Non";
+
+  alert("🔄 Aventure réinitialisée ! Cliquez sur 'Démarrer l'aventure' pour recommencer.");
+}
+
+// Affiche la scène au fil des tokens envoyés par /chat/stream (Server-Sent Events)
+async function streamScene(message, element, clearFirst) {
+  const requestId = [SESSION_ID, adventureId, currentScene, message].join('_');
+  const res = await fetch('/chat/stream', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({ 
+      message: message,
+      session_id: SESSION_ID,
+      request_id: requestId
+    })
+  });
+
+  if (clearFirst) element.innerHTML = "";
+  const sceneSpan = document.createElement('span');
+  element.appendChild(sceneSpan);
+
+  if (!res.ok || !res.body) {
+    sceneSpan.textContent = "Erreur de communication avec le vaisseau IA.";
+    return;
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = "message";
+      let dataLine = "";
+      rawEvent.split("\n").forEach(line => {
+        if (line.startsWith("event: ")) eventName = line.slice(7);
+        else if (line.startsWith("data: ")) dataLine += line.slice(6);
+      });
+      if (!dataLine) continue;
+      const data = JSON.parse(dataLine);
+
+      if (eventName === "done") {
+        // Texte final (nettoyé pour la scène 10) + état de la session
+        sceneSpan.textContent = data.response;
+        updateDebug(data);
+        showChoices(data);
+      } else if (eventName === "error") {
+        sceneSpan.textContent += "\n" + (data.detail || "Erreur de communication avec le vaisseau IA.");
+      } else {
+        sceneSpan.textContent += data.token;
+      }
+    }
+  }
+}
+
+// Les choix arrivent déjà structurés dans la réponse : data.choices = [{id, text}]
+function showChoices(data) {
+  const choicesDiv = document.getElementById('choices');
+
+  // Afficher les boutons pour les scènes 0 à 9 (la scène 9 permet de choisir, puis génère la scène 10)
+  // La scène 10 est la finale, sans boutons
+  if (data.is_final) {
+    // Message de fin si on est à la scène finale (10)
+    choicesDiv.innerHTML = "<p style='color: #FFE81F; font-size: 18px;'>🏁 FIN DE L'AVENTURE 🏁</p>";
+    choicesDiv.style.display = "block";
+  } else if (data.choices && data.choices.length) {
+    choicesDiv.innerHTML = "";
+    choicesDiv.style.display = "block";
+
+    data.choices.forEach(choice => {
+      const btn = document.createElement("button");
+      btn.className = "choice-btn";
+      btn.textContent = `(${choice.id})`;
+      btn.title = choice.text;
+      btn.onclick = () => sendChoice(choice.id);
+      choicesDiv.appendChild(btn);
+    });
+  }
+}
+
+async function sendChoice(number) {
+  if (isWriting) return;
+
+  const storyDiv = document.getElementById('story');
+  const choicesDiv = document.getElementById('choices');
+
+  // Désactive les boutons
+  const buttons = choicesDiv.querySelectorAll('button');
+  buttons.forEach(btn => btn.disabled = true);
+
+  choicesDiv.style.display = "none";
+
+  storyDiv.innerHTML += `<br><em>→ Choix (${number}) sélectionné</em><br><br>`;
+
+  isWriting = true;
+
+  await streamScene(`Je choisis l'option (${number})`, storyDiv, false);
+
+  isWriting = false;
+}
@@ -0,0 +1,74 @@
+"""Fixtures communes : l'app SpaceScenes et le faux backend OpenAI (benchmarks/mock_openai.py),
+reliés en mémoire par httpx.ASGITransport — ni réseau, ni clé d'API, ni appel payant."""
+import json
+import os
+import sys
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Avant l'import de app : configuration lue au chargement du module
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+os.environ["SPACESCENES_JOURNAL"] = "0"
+os.environ["SPACESCENES_SESSION_STORE"] = "memory"
+os.environ["SPACESCENES_RATE_LIMIT_IP_RATE"] = "0"
+os.environ["SPACESCENES_RATE_LIMIT_SESSION_RATE"] = "0"
+os.environ["SPACESCENES_OPENING_CACHE_PREWARM"] = "0"
+os.environ["SPACESCENES_SPECULATIVE"] = "0"
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+import app as spacescenes  # noqa: E402
+from mock_openai import MockSettings, create_mock_app  # noqa: E402
+
+START_MESSAGE = "Salut, démarre une aventure."
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def mock_backend():
+    """Faux backend lent (premier token après 0,2 s) : les requêtes en double se chevauchent"""
+    mock = create_mock_app(MockSettings(ttft=0.2, tokens_per_second=0, scene_tokens=30))
+    previous = spacescenes.client
+    spacescenes.client = AsyncOpenAI(
+        api_key="mock",
+        base_url="http://mock/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=mock)),
+        max_retries=0,
+    )
+    yield mock
+    await spacescenes.client.close()
+    spacescenes.client = previous
+
+
+@pytest.fixture
+async def http(mock_backend):
+    transport = httpx.ASGITransport(app=spacescenes.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://spacescenes", timeout=10) as client:
+        yield client
+
+
+@pytest.fixture
+def session_id():
+    return f"test_{uuid.uuid4().hex[:12]}"
+
+
+async def read_stream(response: httpx.Response) -> dict:
+    """Dernier événement 'done' (ou 'error') d'une réponse SSE"""
+    result, event = None, None
+    async for line in response.aiter_lines():
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: ") and event in ("done", "error"):
+            result = {"event": event, **json.loads(line[6:])}
+        elif not line:
+            event = None
+    return result
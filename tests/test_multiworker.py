@@ -0,0 +1,74 @@
+"""Plusieurs workers sur le même store SQLite : résumé écrit sans changer la version,
+et course entre deux workers (la démo benchmarks/multiworker_demo.py, en test)."""
+import pytest
+
+from app import MemorySessionStore, Role, Session, SqliteSessionStore
+
+pytest.importorskip("uvicorn")
+import multiworker_demo  # noqa: E402
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(max_sessions=100, ttl=60)
+    return SqliteSessionStore(str(tmp_path / "sessions.db"), ttl=60, busy_timeout=0.1)
+
+
+def saved(store, turns: int) -> Session:
+    session = Session()
+    for index in range(turns):
+        session.add_turn(Role.USER, f"message {index}")
+        session.add_turn(Role.ASSISTANT, f"scène {index}")
+    store.save("a", session)
+    return store.get("a")
+
+
+def test_summary_does_not_fail_a_concurrent_turn(store):
+    turn = saved(store, 4)
+    version = turn.version
+
+    # Le résumé arrive pendant que le tour est en cours sur un autre worker
+    assert store.save_summary("a", "résumé", 0, 4, version)
+    turn.add_turn(Role.USER, "suite")
+    store.save("a", turn)
+
+    loaded = store.get("a")
+    assert loaded.version == version + 1
+    assert (loaded.summary, loaded.summarized_upto) == ("résumé", 4)
+    assert len(loaded.history) == 9
+
+
+def test_summary_is_written_once_per_range(store):
+    session = saved(store, 4)
+
+    assert store.save_summary("a", "premier", 0, 4, session.version)
+    assert not store.save_summary("a", "second", 0, 4, session.version)
+    assert store.get("a").summary == "premier"
+
+
+def test_summary_is_dropped_after_a_reset(store):
+    session = saved(store, 4)
+    store.delete("a")
+    store.save("a", Session())
+
+    assert not store.save_summary("a", "ancienne partie", 0, 4, session.version)
+    assert store.get("a").summary == ""
+
+
+@pytest.fixture(scope="module")
+def workers(tmp_path_factory):
+    processes, urls = multiworker_demo.start_processes(2, str(tmp_path_factory.mktemp("workers")))
+    yield urls
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def test_adventure_bounces_between_workers(workers):
+    multiworker_demo.play_bouncing_adventure(workers)
+
+
+def test_simultaneous_turns_on_two_workers_keep_one(workers):
+    assert multiworker_demo.race_same_session(workers) == [200, 409]
@@ -0,0 +1,189 @@
+"""SessionGate : fusion des requêtes en double, rejeu idempotent, nettoyage des verrous,
+propagation des erreurs aux requêtes en attente — via /chat et /chat/stream."""
+import asyncio
+import json
+
+import anyio
+import pytest
+
+import app as spacescenes
+from conftest import START_MESSAGE, read_stream
+
+pytestmark = pytest.mark.anyio
+
+CHOICE = "Je choisis l'option (1)"
+
+
+async def start_adventure(http, session_id: str):
+    response = await http.post("/chat", json={"message": START_MESSAGE, "session_id": session_id})
+    assert response.status_code == 200
+
+
+async def stream_turn(http, session_id: str, message: str, **extra) -> dict:
+    async with http.stream("POST", "/chat/stream", json={"message": message, "session_id": session_id, **extra}) as response:
+        assert response.status_code == 200
+        return await read_stream(response)
+
+
+def scene_count(session_id: str) -> int:
+    return spacescenes.get_session_store().get(session_id).scene_count
+
+
+def assert_released(session_id: str):
+    gate = spacescenes.session_gate
+    assert session_id not in gate._locks
+    assert not [key for key in gate._inflight if key[0] == session_id]
+
+
+async def test_duplicate_chat_requests_play_one_turn(http, mock_backend, session_id):
+    await start_adventure(http, session_id)
+    calls = mock_backend.state.requests
+    coalesced = spacescenes.session_gate.coalesced
+
+    first, second = await asyncio.gather(
+        http.post("/chat", json={"message": CHOICE, "session_id": session_id}),
+        http.post("/chat", json={"message": CHOICE, "session_id": session_id}),
+    )
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert mock_backend.state.requests - calls == 1
+    assert spacescenes.session_gate.coalesced == coalesced + 1
+    assert scene_count(session_id) == 1
+    assert_released(session_id)
+
+
+async def test_duplicate_streams_play_one_turn(http, mock_backend, session_id):
+    await start_adventure(http, session_id)
+    calls = mock_backend.state.requests
+
+    first, second = await asyncio.gather(
+        stream_turn(http, session_id, CHOICE),
+        stream_turn(http, session_id, CHOICE),
+    )
+
+    assert first["event"] == second["event"] == "done"
+    assert first["response"] == second["response"]
+    assert mock_backend.state.requests - calls == 1
+    assert scene_count(session_id) == 1
+    assert_released(session_id)
+
+
+async def test_chat_and_stream_duplicates_share_the_turn(http, mock_backend, session_id):
+    await start_adventure(http, session_id)
+    calls = mock_backend.state.requests
+
+    chat, streamed = await asyncio.gather(
+        http.post("/chat", json={"message": CHOICE, "session_id": session_id}),
+        stream_turn(http, session_id, CHOICE),
+    )
+
+    assert chat.status_code == 200
+    assert chat.json()["response"] == streamed["response"]
+    assert mock_backend.state.requests - calls == 1
+    assert scene_count(session_id) == 1
+
+
+async def test_request_id_replays_the_finished_turn(http, mock_backend, session_id):
+    await start_adventure(http, session_id)
+    body = {"message": CHOICE, "session_id": session_id, "request_id": f"{session_id}_0_choice1"}
+    first = await http.post("/chat", json=body)
+    calls = mock_backend.state.requests
+    replayed = spacescenes.session_gate.replayed
+
+    # Renvoi après la fin du tour (double clic, réseau) : même scène, pas de nouveau tour
+    again = await http.post("/chat", json=body)
+    streamed = await stream_turn(http, session_id, CHOICE, request_id=body["request_id"])
+
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json()
+    assert streamed["response"] == first.json()["response"]
+    assert mock_backend.state.requests == calls
+    assert spacescenes.session_gate.replayed == replayed + 2
+    assert scene_count(session_id) == 1
+
+
+async def test_sequential_turns_with_different_messages_both_play(http, session_id):
+    await start_adventure(http, session_id)
+    await http.post("/chat", json={"message": CHOICE, "session_id": session_id})
+    response = await http.post("/chat", json={"message": "Je choisis l'option (2)", "session_id": session_id})
+
+    assert response.status_code == 200
+    assert scene_count(session_id) == 2
+    assert_released(session_id)
+
+
+async def test_upstream_error_reaches_every_waiter(http, mock_backend, session_id):
+    await start_adventure(http, session_id)
+    settings = mock_backend.state.settings
+    settings.error_rate, settings.error_status = 1.0, 400  # erreur définitive, sans retry
+    try:
+        with anyio.fail_after(5):
+            first, second = await asyncio.gather(
+                http.post("/chat", json={"message": CHOICE, "session_id": session_id}),
+                http.post("/chat", json={"message": CHOICE, "session_id": session_id}),
+            )
+    finally:
+        settings.error_rate = 0.0
+
+    assert first.status_code == second.status_code == 502
+    assert scene_count(session_id) == 0
+    assert_released(session_id)
+    # Rien ne reste bloqué : le même tour peut être rejoué
+    retry = await http.post("/chat", json={"message": CHOICE, "session_id": session_id})
+    assert retry.status_code == 200
+    assert scene_count(session_id) == 1
+
+
+async def test_stream_error_reaches_the_waiting_request(http, mock_backend, session_id):
+    await start_adventure(http, session_id)
+    settings = mock_backend.state.settings
+    settings.error_rate, settings.error_status = 1.0, 400
+    try:
+        with anyio.fail_after(5):
+            streamed, chat = await asyncio.gather(
+                http.post("/chat/stream", json={"message": CHOICE, "session_id": session_id}),
+                http.post("/chat", json={"message": CHOICE, "session_id": session_id}),
+            )
+    finally:
+        settings.error_rate = 0.0
+
+    assert streamed.status_code == chat.status_code == 502
+    assert_released(session_id)
+
+
+async def call_without_response_start(path: str, body: dict):
+    """Appel ASGI dont le client disparaît avant l'envoi des en-têtes (OSError sur http.response.start)"""
+    messages = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("connexion fermée")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("spacescenes", 80),
+    }
+    with pytest.raises(OSError):
+        await spacescenes.app(scope, receive, send)
+
+
+async def test_stream_that_never_starts_releases_the_session(http, session_id):
+    await start_adventure(http, session_id)
+    admitted = spacescenes.admission.active
+
+    await call_without_response_start("/chat/stream", {"message": CHOICE, "session_id": session_id})
+
+    assert_released(session_id)
+    assert spacescenes.admission.active == admitted
+    assert spacescenes.scheduler.inflight == 0
+    with anyio.fail_after(5):
+        streamed = await stream_turn(http, session_id, CHOICE)
+    assert streamed["event"] == "done"
@@ -0,0 +1,125 @@
+"""SessionStore : verrouillage optimiste (save), expiration et réinsertion, pour les deux backends."""
+import time
+
+import pytest
+
+from app import MemorySessionStore, Role, Session, SessionConflict, SqliteSessionStore
+
+TTL = 0.2
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(max_sessions=100, ttl=TTL)
+    return SqliteSessionStore(str(tmp_path / "sessions.db"), ttl=TTL, busy_timeout=0.1)
+
+
+def played(turns: int) -> Session:
+    session = Session()
+    for index in range(turns):
+        session.add_turn(Role.USER, f"message {index}")
+        session.add_turn(Role.ASSISTANT, f"scène {index} " + "x" * 300)
+    return session
+
+
+def test_save_then_get_round_trip(store):
+    session = played(2)
+    store.save("a", session)
+
+    loaded = store.get("a")
+    assert session.version == loaded.version == 1
+    assert [turn.content for turn in loaded.history] == [turn.content for turn in session.history]
+    assert len(store) == 1
+
+
+def test_each_save_bumps_the_version(store):
+    session = Session()
+    store.save("a", session)
+    session = store.get("a")
+    session.scene_count = 3
+    store.save("a", session)
+
+    assert session.version == 2
+    assert store.get("a").scene_count == 3
+
+
+def test_stale_save_is_refused(store):
+    store.save("a", Session())
+    first = store.get("a")
+    # Lecture concurrente (autre worker) : sa propre copie, à la même version
+    second = Session(scene_count=5, version=first.version)
+    first.scene_count = 1
+    store.save("a", first)
+
+    with pytest.raises(SessionConflict):
+        store.save("a", second)
+    assert store.get("a").scene_count == 1
+
+
+def test_concurrent_creation_keeps_the_first(store):
+    store.save("a", Session(scene_count=1))
+    with pytest.raises(SessionConflict):
+        store.save("a", Session(scene_count=2))
+    assert store.get("a").scene_count == 1
+
+
+def test_save_after_delete_is_refused(store):
+    store.save("a", Session())
+    session = store.get("a")
+    store.delete("a")
+
+    session.scene_count = 1
+    with pytest.raises(SessionConflict):
+        store.save("a", session)
+    assert store.get("a") is None
+
+
+def test_expired_session_disappears(store):
+    store.save("a", Session())
+    time.sleep(TTL * 1.5)
+
+    assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_expired_row_can_be_created_again(store):
+    store.save("a", Session(scene_count=4))
+    time.sleep(TTL * 1.5)
+
+    fresh = Session()
+    store.save("a", fresh)
+    assert fresh.version == 1
+    assert store.get("a").scene_count == 0
+
+
+def test_get_extends_the_ttl(store):
+    store.save("a", Session())
+    for _ in range(3):
+        time.sleep(TTL * 0.6)
+        session = store.get("a")
+        assert session is not None
+        store.save("a", session)
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2, ttl=60)
+    for session_id in ("a", "b"):
+        store.save(session_id, Session())
+    store.get("a")
+    store.save("c", Session())
+
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.evicted == 1
+
+
+def test_history_length_without_loading(store):
+    assert store.history_length("a") is None
+    store.save("a", Session())
+    assert store.history_length("a") == 0
+    store.save("b", played(2))
+    assert store.history_length("b") == 4
+
+    time.sleep(TTL * 1.5)
+    assert store.history_length("b") is None
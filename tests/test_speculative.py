@@ -0,0 +1,49 @@
+"""SpeculativeGenerator : les branches d'une session abandonnée expirent avec la session."""
+import asyncio
+
+import pytest
+
+import app as spacescenes
+from app import Role, Session, SpeculativeGenerator
+
+pytestmark = pytest.mark.anyio
+
+TTL = 0.3
+
+
+def started() -> Session:
+    session = Session()
+    session.add_turn(Role.USER, "Salut")
+    session.add_turn(Role.ASSISTANT, "Quel personnage ?")
+    session.add_turn(Role.USER, "Un pilote")
+    session.add_turn(Role.ASSISTANT, "Scène 1\n(1) A\n(2) B\n(3) C")
+    session.scene_count = 1
+    return session
+
+
+async def test_abandoned_speculations_expire_with_the_session(mock_backend):
+    speculator = SpeculativeGenerator(True, token_budget=100_000, max_load=1.0, max_sessions=100, ttl=TTL)
+    speculator.schedule("abandoned", started())
+    await asyncio.gather(*speculator._speculations["abandoned"].tasks.values())
+
+    await asyncio.sleep(TTL * 1.5)
+    session = started()
+    speculator.schedule("active", session)
+
+    assert list(speculator._speculations) == ["active"]
+    assert speculator.expired == 1
+    assert speculator.wasted_tokens > 0
+    assert await speculator.take("active", session, 1) is not None
+    await speculator.close()
+
+
+async def test_live_speculation_is_kept(mock_backend):
+    speculator = SpeculativeGenerator(True, token_budget=100_000, max_load=1.0, max_sessions=100, ttl=60)
+    session = started()
+    speculator.schedule("a", session)
+    speculator.schedule("b", started())
+
+    assert await speculator.take("a", session, 2) is not None
+    assert speculator.expired == 0
+    await speculator.close()
+    assert spacescenes.scheduler.inflight == 0